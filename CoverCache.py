@@ -0,0 +1,142 @@
+import os
+import json
+import struct
+import hashlib
+import tempfile
+
+import KindleUnpack
+
+
+# A host directory of covers and ebook metadata shared by the runs on many
+# Kindles, keyed by a fingerprint of the ebook rather than its path. Every
+# file is written aside and renamed into place and a missing file is just a
+# miss, so several processes can share the directory. Hits refresh the
+# mtime, which evict() uses to drop the least recently used files.
+class CoverCache:
+    sample_size = 64 * 1024
+    record_limit = 1024 * 1024
+
+    def __init__(self, path, limit=1024 * 1024 * 1024):
+        self.path = path
+        self.limit = limit
+        os.makedirs(self.path, exist_ok=True)
+
+    # The size and a hash of the palm header, the section table and the
+    # first record, which holds the EXTH metadata. Other files hash their
+    # first bytes (the KFX header, index and symbols).
+    def get_fingerprint(self, path):
+        digest = hashlib.sha1()
+        with open(path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            header = file.read(78)
+            digest.update(header)
+            KindleUnpack.count_read(len(header))
+            if len(header) == 78 and \
+                    header[0x3C:0x44] in KindleUnpack.Sectionizer.idents:
+                count, = struct.unpack_from('>H', header, 76)
+                table = file.read(count * 8)
+                digest.update(table)
+                if len(table) < count * 8:
+                    raise OSError('The section table is truncated!')
+                offsets = struct.unpack_from(
+                    '>%dL' % (min(count, 2) * 2), table
+                )
+                start = offsets[0] if count > 0 else 78
+                end = offsets[2] if count > 1 else size
+                file.seek(start)
+                record = file.read(min(end - start, self.record_limit))
+                KindleUnpack.count_read(len(table) + len(record))
+            else:
+                record = file.read(self.sample_size)
+                KindleUnpack.count_read(len(record))
+            digest.update(record)
+        return '%x-%s' % (size, digest.hexdigest())
+
+    def get_entry_path(self, fingerprint, suffix):
+        return os.path.join(
+            self.path, fingerprint[-2:], '%s.%s' % (fingerprint, suffix)
+        )
+
+    def get_cover_suffix(self, size):
+        return 'cover.jpg' if size is None else '%dx%d.jpg' % size
+
+    def read(self, path):
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    # Every write has a temporary file of its own, threads and processes
+    # caching the same ebook never write into each other's.
+    def write(self, path, data):
+        temp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            descriptor, temp_path = tempfile.mkstemp(
+                prefix='.', suffix='.tmp', dir=os.path.dirname(path)
+            )
+            with os.fdopen(descriptor, 'wb') as file:
+                file.write(data)
+            os.replace(temp_path, path)
+        except OSError:
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def get_metadata(self, fingerprint):
+        data = self.read(self.get_entry_path(fingerprint, 'json'))
+        try:
+            return json.loads(data.decode('utf-8')) if data else None
+        except ValueError:
+            return None
+
+    def set_metadata(self, fingerprint, asin, cdetype, cover, thumb=None):
+        self.write(self.get_entry_path(fingerprint, 'json'), json.dumps({
+            'asin': asin,
+            'cdetype': cdetype,
+            'cover': list(cover) if cover is not None else None,
+            'thumb': list(thumb) if thumb is not None else None,
+        }).encode('utf-8'))
+
+    def get_cover(self, fingerprint, size=None):
+        return self.read(
+            self.get_entry_path(fingerprint, self.get_cover_suffix(size))
+        )
+
+    def set_cover(self, fingerprint, size, data):
+        if data is not None:
+            self.write(self.get_entry_path(
+                fingerprint, self.get_cover_suffix(size)
+            ), data)
+
+    # Remove the least recently used files until the cache is below 90% of
+    # its limit.
+    def evict(self):
+        entries = []
+        total = 0
+        for directory in os.scandir(self.path):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                total += stat.st_size
+        if total <= self.limit:
+            return 0
+        removed = 0
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.limit * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
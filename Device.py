@@ -0,0 +1,127 @@
+import os
+import re
+import sys
+import time
+import threading
+
+
+# File systems a Kindle shows up with over USB mass storage.
+MOUNT_FILESYSTEMS = ('vfat', 'msdos', 'exfat', 'fuseblk')
+
+MOUNT_ESCAPE = re.compile(r'\\([0-7]{3})')
+
+discovery_cache = {'time': None, 'roots': []}
+discovery_lock = threading.Lock()
+
+
+# Identify the physical bus a Kindle root is attached to, so that devices
+# sharing a USB controller are not all read at once. On Linux this is the
+# USB root hub (usbN) in the sysfs path of the block device, elsewhere the
+# device itself.
+def get_device_bus(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return path
+    if sys.platform.startswith('linux'):
+        device = os.path.realpath('/sys/dev/block/%d:%d' % (
+            os.major(stat.st_dev), os.minor(stat.st_dev)
+        ))
+        parts = device.split('/')
+        for index, part in enumerate(parts):
+            if part.startswith('usb') and part[3:].isdigit():
+                return '/'.join(parts[:index + 1])
+    return stat.st_dev
+
+
+def unescape_mount_path(path):
+    # mountinfo escapes spaces, tabs, newlines and backslashes as \ooo.
+    return MOUNT_ESCAPE.sub(lambda match: chr(int(match.group(1), 8)), path)
+
+
+def is_removable_device(major, minor):
+    device = os.path.realpath('/sys/dev/block/%d:%d' % (major, minor))
+    if '/usb' in device:
+        return True
+    # A partition has its removable flag on the parent disk.
+    for path in (device, os.path.dirname(device)):
+        try:
+            with open(os.path.join(path, 'removable'), 'r') as file:
+                return file.read().strip() == '1'
+        except OSError:
+            continue
+    return False
+
+
+# The mount points of removable FAT/exFAT file systems, from a single read
+# of /proc/self/mountinfo.
+def get_linux_mounts(path='/proc/self/mountinfo'):
+    mounts = []
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as file:
+            lines = file.readlines()
+    except OSError:
+        return mounts
+    for line in lines:
+        fields = line.split()
+        try:
+            separator = fields.index('-')
+            major, minor = [int(n) for n in fields[2].split(':')]
+            mount_point = unescape_mount_path(fields[4])
+            filesystem = fields[separator + 1]
+        except (ValueError, IndexError):
+            continue
+        if filesystem in MOUNT_FILESYSTEMS \
+                and is_removable_device(major, minor):
+            mounts.append(mount_point)
+    return mounts
+
+
+def get_candidate_paths():
+    if sys.platform.startswith('linux'):
+        return get_linux_mounts()
+    elif sys.platform.startswith('win'):
+        import string
+        drives = ['%s:\\' % s.upper() for s in string.ascii_lowercase[:26]]
+        drives.reverse()
+        return drives
+    elif sys.platform.startswith('darwin'):
+        import glob
+        return glob.glob('/Volumes/*')
+    return []
+
+
+# Check every path on its own daemon thread and keep the ones which passed
+# within the timeout. A hung network drive or empty card reader only
+# delays the discovery by the timeout, and never the exit.
+def probe_paths(paths, check, timeout=2.0):
+    results = dict()
+
+    def probe(path):
+        try:
+            results[path] = check(path)
+        except OSError:
+            results[path] = False
+
+    threads = []
+    for path in paths:
+        thread = threading.Thread(target=probe, args=(path,), daemon=True)
+        thread.start()
+        threads.append(thread)
+    deadline = time.monotonic() + timeout
+    for thread in threads:
+        thread.join(max(deadline - time.monotonic(), 0))
+    return [path for path in paths if results.get(path) is True]
+
+
+# Kindle roots among the mounted volumes, cached for ttl seconds so that the
+# GUI and repeated runs do not probe the drives again.
+def find_kindle_roots(check, timeout=2.0, ttl=10.0):
+    with discovery_lock:
+        if discovery_cache['time'] is not None \
+                and time.monotonic() - discovery_cache['time'] < ttl:
+            return list(discovery_cache['roots'])
+        roots = probe_paths(get_candidate_paths(), check, timeout)
+        discovery_cache['time'] = time.monotonic()
+        discovery_cache['roots'] = roots
+        return list(roots)
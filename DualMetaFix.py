@@ -17,9 +17,9 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import struct
 import mmap
-import shutil
 
 
 class DualMetaFixException(Exception):
@@ -42,10 +42,7 @@ def getint(data, ofs, sz='L'):
 
 
 def writeint(data, ofs, n, slen='L'):
-    if slen == 'L':
-        return data[:ofs]+struct.pack('>L', n)+data[ofs+4:]
-    else:
-        return data[:ofs]+struct.pack('>H', n)+data[ofs+2:]
+    struct.pack_into('>'+slen, data, ofs, n)
 
 
 def getsecaddr(datain, secno):
@@ -85,20 +82,6 @@ def get_exth_params(rec0):
     return ebase, elen, enum, rlen
 
 
-def add_exth(rec0, exth_num, exth_bytes):
-    ebase, elen, enum, rlen = get_exth_params(rec0)
-    newrecsize = 8+len(exth_bytes)
-    newrec0 = rec0[0:ebase+4]+struct.pack('>L', elen+newrecsize)+struct.pack('>L', enum+1)+struct.pack('>L', exth_num)\
-        + struct.pack('>L', newrecsize)+exth_bytes+rec0[ebase+12:]
-    newrec0 = writeint(newrec0, title_offset, getint(newrec0, title_offset)+newrecsize)
-    # keep constant record length by removing newrecsize null bytes from end
-    sectail = newrec0[-newrecsize:]
-    if sectail != b'\0'*newrecsize:
-        raise DualMetaFixException('add_exth: trimmed non-null bytes at end of section')
-    newrec0 = newrec0[0:rlen]
-    return newrec0
-
-
 def read_exth(rec0, exth_num):
     exth_values = []
     ebase, elen, enum, rlen = get_exth_params(rec0)
@@ -113,73 +96,86 @@ def read_exth(rec0, exth_num):
     return exth_values
 
 
-def del_exth(rec0, exth_num):
+# Replace every EXTH record of the given ids with the given values in one
+# pass over a bytearray rec0, keeping its length constant.
+def set_exth(rec0, records):
     ebase, elen, enum, rlen = get_exth_params(rec0)
-    ebase_idx = ebase+12
-    enum_idx = 0
-    while enum_idx < enum:
-        exth_id = getint(rec0, ebase_idx)
-        exth_size = getint(rec0, ebase_idx+4)
-        if exth_id == exth_num:
-            newrec0 = rec0
-            newrec0 = writeint(newrec0, title_offset, getint(newrec0, title_offset)-exth_size)
-            newrec0 = newrec0[:ebase_idx]+newrec0[ebase_idx+exth_size:]
-            newrec0 = newrec0[0:ebase+4]+struct.pack('>L', elen-exth_size)+struct.pack('>L', enum-1)+newrec0[ebase+12:]
-            newrec0 += b'\0'*exth_size
-            if rlen != len(newrec0):
-                raise DualMetaFixException('del_exth: incorrect section size change')
-            return newrec0
-        enum_idx += 1
-        ebase_idx = ebase_idx+exth_size
+    kept = []
+    pos = ebase+12
+    for _ in range(enum):
+        exth_id = getint(rec0, pos)
+        exth_size = getint(rec0, pos+4)
+        if exth_id not in records:
+            kept.append(bytes(rec0[pos:pos+exth_size]))
+        pos += exth_size
+    added = [
+        struct.pack('>LL', exth_num, 8+len(exth_bytes))+exth_bytes
+        for exth_num, exth_bytes in records.items()
+    ]
+    body = b''.join(kept+added)
+    delta = len(body)-(pos-ebase-12)
+    # keep constant record length by removing delta null bytes from end
+    if delta > 0 and rec0[rlen-delta:] != b'\0'*delta:
+        raise DualMetaFixException(
+            'set_exth: trimmed non-null bytes at end of section'
+        )
+    rec0[ebase+12:pos] = body
+    struct.pack_into('>LL', rec0, ebase+4, elen+delta, len(kept)+len(added))
+    writeint(rec0, title_offset, getint(rec0, title_offset)+delta)
+    if delta > 0:
+        del rec0[rlen:]
+    else:
+        rec0.extend(b'\0'*-delta)
     return rec0
 
 
+# Set cdetype and ASIN in the MOBI7 and KF8 headers. Both headers are
+# rebuilt before anything is written, and only they are written back, in
+# place when outfile is None or the book itself.
 class DualMobiMetaFix:
-    def __init__(self, infile, outfile, asin):
-        shutil.copyfile(infile, outfile)
-        f = open(outfile, "r+b")
-        self.datain = mmap.mmap(f.fileno(), 0)
-        self.datain_rec0 = readsection(self.datain, 0)
-
-        # in the first mobi header
-        # add 501 to "EBOK", add 113 as asin, add 504 as asin
-        rec0 = self.datain_rec0
-        rec0 = del_exth(rec0, 501)
-        rec0 = del_exth(rec0, 113)
-        rec0 = del_exth(rec0, 504)
-        rec0 = add_exth(rec0, 501, b'EBOK')
-        rec0 = add_exth(rec0, 113, asin)
-        rec0 = add_exth(rec0, 504, asin)
-        replacesection(self.datain, 0, rec0)
-
+    def __init__(self, infile, outfile, asin, cdetype=b'EBOK'):
+        if outfile is not None and \
+                os.path.abspath(outfile) != os.path.abspath(infile):
+            import shutil
+            shutil.copyfile(infile, outfile)
+            infile = outfile
+        records = {501: cdetype, 113: asin, 504: asin}
+
+        with open(infile, 'r+b') as f:
+            self.datain = mmap.mmap(f.fileno(), 0)
+            try:
+                self.datain_rec0 = readsection(self.datain, 0)
+                sections = [
+                    (0, set_exth(bytearray(self.datain_rec0), records))
+                ]
+
+                self.datain_kf8 = self.get_kf8_section()
+                self.combo = self.datain_kf8 is not None
+                if self.combo:
+                    self.datain_kfrec0 = readsection(
+                        self.datain, self.datain_kf8
+                    )
+                    sections.append((
+                        self.datain_kf8,
+                        set_exth(bytearray(self.datain_kfrec0), records)
+                    ))
+
+                for secno, rec0 in sections:
+                    replacesection(self.datain, secno, rec0)
+                self.datain.flush()
+            finally:
+                self.datain.close()
+
+    def get_kf8_section(self):
         ver = getint(self.datain_rec0, mobi_version)
-        self.combo = (ver != 8)
-        if not self.combo:
-            return
-
+        if ver == 8:
+            return None
+        # only pay attention to first exth121
+        # (there should only be one)
         exth121 = read_exth(self.datain_rec0, 121)
         if len(exth121) == 0:
-            self.combo = False
-            return
-        else:
-            # only pay attention to first exth121
-            # (there should only be one)
-            datain_kf8, = struct.unpack_from('>L', exth121[0], 0)
-            if datain_kf8 == 0xffffffff:
-                self.combo = False
-                return
-        self.datain_kfrec0 = readsection(self.datain, datain_kf8)
-
-        # in the second header
-        # add 501 to "EBOK", add 113 as asin, add 504 as asin
-        rec0 = self.datain_kfrec0
-        rec0 = del_exth(rec0, 501)
-        rec0 = del_exth(rec0, 113)
-        rec0 = del_exth(rec0, 504)
-        rec0 = add_exth(rec0, 501, b'EBOK')
-        rec0 = add_exth(rec0, 113, asin)
-        rec0 = add_exth(rec0, 504, asin)
-        replacesection(self.datain, datain_kf8, rec0)
-
-        self.datain.flush()
-        self.datain.close()
+            return None
+        datain_kf8, = struct.unpack_from('>L', exth121[0], 0)
+        if datain_kf8 == 0xffffffff:
+            return None
+        return datain_kf8
@@ -0,0 +1,120 @@
+import os
+import sys
+import json
+import time
+
+
+# message, run_started, run_finished, phase_started, phase_finished,
+# progress, book_fixed, book_generated, book_converted, cover_missing,
+# orphan_deleted, root_finished, plan, stats
+class Event:
+    __slots__ = ('type', 'time', 'data')
+
+    def __init__(self, type, **data):
+        self.type = type
+        self.time = time.time()
+        self.data = data
+
+    def __getattr__(self, name):
+        try:
+            return self.data[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def to_dict(self):
+        event = {'type': self.type, 'time': self.time}
+        event.update(self.data)
+        return event
+
+
+# Format events as the human readable log of the command line and the GUI.
+class TextSink:
+    divider = '-------------------------------------------'
+
+    # The JSON documents (plan and stats) go to document_writer when it is
+    # given, so that they can be kept apart from the log.
+    def __init__(self, writer=print, document_writer=None):
+        self.writer = writer
+        self.document_writer = document_writer or writer
+
+    def __call__(self, event):
+        text = self.format(event)
+        if text is None:
+            return
+        if event.type in ('plan', 'stats'):
+            self.document_writer(text)
+        else:
+            self.writer(text)
+
+    def format_book(self, status, event):
+        return '✓ %s: %s\n  └─[%s] %s' % (
+            status, os.path.basename(event.thumbnail), event.cdetype,
+            os.path.basename(event.ebook)
+        )
+
+    def format(self, event):
+        if event.type == 'message':
+            return '%s\n%s\n%s' % (self.divider, event.text, self.divider) \
+                if event.sep else event.text
+        elif event.type == 'book_fixed':
+            return self.format_book('Fixed', event)
+        elif event.type == 'book_generated':
+            return self.format_book('Generated', event)
+        elif event.type == 'book_converted':
+            return '✓ Converted: %s\n  └─[%s → EBOK] %s' % (
+                os.path.basename(event.ebook), event.cdetype, event.asin
+            )
+        elif event.type == 'orphan_deleted':
+            return '✓ %s: %s' % (
+                'Quarantine' if event.data.get('quarantine') else 'Delete',
+                os.path.basename(event.thumbnail)
+            )
+        elif event.type in ('plan', 'stats'):
+            return json.dumps(
+                event.data[event.type], indent=2, ensure_ascii=False
+            )
+        return None
+
+
+class JSONLinesSink:
+    def __init__(self, stream=None):
+        self.stream = stream if stream is not None else sys.stdout
+
+    def __call__(self, event):
+        self.stream.write(
+            json.dumps(event.to_dict(), ensure_ascii=False) + '\n'
+        )
+        if event.type in ('run_finished', 'progress'):
+            self.stream.flush()
+
+
+# Stay quiet during the run and only report the totals at the end.
+class SummarySink:
+    counted = (
+        'book_fixed', 'book_generated', 'book_converted', 'cover_missing',
+        'orphan_deleted'
+    )
+
+    def __init__(self, writer=print):
+        self.writer = writer
+        self.counts = dict()
+        self.started = None
+
+    def __call__(self, event):
+        if event.type == 'run_started':
+            self.counts = dict((name, 0) for name in self.counted)
+            self.started = event.time
+        elif event.type in self.counted:
+            self.counts[event.type] = self.counts.get(event.type, 0) + 1
+        elif event.type == 'run_finished':
+            self.writer(
+                'Fixed: %d, Generated: %d, Converted: %d, No cover: %d, '
+                'Deleted: %d (%.1fs)' % (
+                    self.counts.get('book_fixed', 0),
+                    self.counts.get('book_generated', 0),
+                    self.counts.get('book_converted', 0),
+                    self.counts.get('cover_missing', 0),
+                    self.counts.get('orphan_deleted', 0),
+                    event.time - (self.started or event.time),
+                )
+            )
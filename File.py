@@ -20,78 +20,209 @@ __license__ = 'GPL-3'
 __copyright__ = '2014, Pawel Jastrzebski <pawelj@iosphe.re>'
 
 import os
-import random
-import string
-from imghdr import what
-from io import BytesIO
-from tempfile import gettempdir
-from uuid import uuid4
-
-import DualMetaFix
+
+import KFX
 import KindleUnpack
+from Thumbnail import get_image_type
+
+RESOURCE_TYPES = {
+    b'FLIS': 'FLIS',
+    b'FCIS': 'FCIS',
+    b'FDST': 'FDST',
+    b'DATP': 'DATP',
+    b'SRCS': 'SRCS',
+    b'CMET': 'CMET',
+    b'FONT': 'FONT',
+    b'RESC': 'RESC',
+    b'\xe9\x8e\r\n': 'EOF',
+}
+
+IMAGE_TYPES = ('jpeg', 'png', 'gif')
 
 
 class MOBIFile:
     def __init__(self, path):
         self.path = path
-        self.section = KindleUnpack.Sectionizer(self.path)
-        self.mh = [KindleUnpack.MobiHeader(self.section, 0)][0]
-        self.metadata = self.mh.getmetadata()
         self.check_file()
+        self.section = KindleUnpack.Sectionizer(self.path)
+        try:
+            if self.section.ident != b'BOOKMOBI':
+                raise OSError('The specified file is not E-Book!')
+            self.mh = [KindleUnpack.MobiHeader(self.section, 0)][0]
+            self.kf8_header = None
+            self.resources = dict()
+        except Exception:
+            self.section.close()
+            raise
 
     def check_file(self):
         if not os.path.isfile(self.path):
             raise OSError('The specified file does not exist!')
         file_extension = os.path.splitext(self.path)[1].upper()
-        if file_extension not in ['.MOBI', '.AZW', '.AZW3']:
-            raise OSError('The specified file is not E-Book!')
-        mobi_header = open(self.path, 'rb').read(100)
-        palm_header = mobi_header[0:78]
-        ident = palm_header[0x3C:0x3C+8]
-        if ident != b'BOOKMOBI':
+        if file_extension not in ['.MOBI', '.AZW', '.AZW3', '.AZW4']:
             raise OSError('The specified file is not E-Book!')
 
+    def close(self):
+        self.section.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # The full metadata map of the first header, decoded on first use.
+    @property
+    def metadata(self):
+        return self.mh.getmetadata()
+
+    def get_metadata(self, key):
+        values = self.mh.getmetadatavalue(key)
+        if values is None:
+            return None
+        return values[0].decode('utf-8') \
+            if isinstance(values[0], bytes) else values[0]
+
+    def get_resource_type(self, section):
+        offset = self.section.sectionoffsets[section]
+        head = bytes(self.section.read(offset, 8))
+        if head[:4] in RESOURCE_TYPES:
+            return RESOURCE_TYPES[head[:4]]
+        if head == b'BOUNDARY':
+            return 'BOUNDARY'
+        return get_image_type(head)
+
+    # Maps every resource ordinal of a header to (section number, type),
+    # classified from the first bytes of each section only.
+    def get_resources(self, mh):
+        if mh.start not in self.resources:
+            end = self.section.num_sections
+            if mh.start < self.kf8_boundary < end:
+                end = self.kf8_boundary
+            self.resources[mh.start] = [
+                (i, self.get_resource_type(i))
+                for i in range(mh.firstresource, end)
+            ]
+        return self.resources[mh.start]
+
+    def get_image_section(self, mh, key):
+        values = mh.getmetadatavalue(key)
+        if values is None:
+            return None
+        ordinal = int(values[0])
+        resources = self.get_resources(mh)
+        if ordinal < len(resources) and resources[ordinal][1] in IMAGE_TYPES:
+            return resources[ordinal][0]
+        return None
+
+    @property
+    def kf8_boundary(self):
+        boundary = self.mh.getmetadatavalue('K8(121)_Boundary_Section')
+        if boundary is None or int(boundary[0]) == 0xffffffff:
+            return -1
+        return int(boundary[0])
+
+    def get_kf8_header(self):
+        if self.kf8_header is None and 0 < self.kf8_boundary \
+                < self.section.num_sections:
+            self.kf8_header = KindleUnpack.MobiHeader(
+                self.section, self.kf8_boundary
+            )
+        return self.kf8_header
+
+    def get_headers(self):
+        headers = [self.mh]
+        kf8_header = self.get_kf8_header()
+        if kf8_header is not None:
+            headers.append(kf8_header)
+        return headers
+
+    def get_cover_section(self, keys=('CoverOffset', 'ThumbOffset')):
+        headers = self.get_headers()
+        for key in keys:
+            for mh in headers:
+                section = self.get_image_section(mh, key)
+                if section is not None:
+                    return section
+        raise OSError('No cover image was found.')
+
+    def get_section_location(self, section):
+        before, after = self.section.sectionoffsets[section:section+2]
+        return (before, after - before)
+
+    def get_cover_location(self):
+        return self.get_section_location(self.get_cover_section())
+
+    def get_thumb_location(self):
+        try:
+            section = self.get_cover_section(('ThumbOffset',))
+        except OSError:
+            return None
+        return self.get_section_location(section)
+
+    def get_cover_image(self):
+        return bytes(self.section.load_section(self.get_cover_section()))
+
+    def get_thumb_image(self):
+        try:
+            section = self.get_cover_section(('ThumbOffset',))
+        except OSError:
+            return None
+        return bytes(self.section.load_section(section))
+
+
+# The same interface as MOBIFile for KFX containers, which have no separate
+# thumbnail image.
+class KFXFile:
+    metadata_names = {
+        'ASIN': 'ASIN',
+        'Document Type': 'cde_content_type',
+    }
+
+    def __init__(self, path):
+        self.path = path
+        self.container = KFX.KFXContainer(self.path)
+        try:
+            self.metadata = self.container.get_metadata()
+        except Exception:
+            self.container.close()
+            raise
+
+    def close(self):
+        self.container.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
     def get_metadata(self, key):
-        return self.metadata[key][0].decode('utf-8') \
-            if key in self.metadata.keys() else None
+        return self.metadata.get(self.metadata_names.get(key, key))
+
+    def get_cover_location(self):
+        name = self.metadata.get('cover_image')
+        location = self.container.get_resource_location(name) \
+            if name is not None else None
+        if location is None:
+            raise OSError('No cover image was found.')
+        return location
+
+    def get_thumb_location(self):
+        return None
 
     def get_cover_image(self):
-        coverid = int(self.metadata['CoverOffset'][0])
-        beg = self.mh.firstresource
-        end = self.section.num_sections
-        imgnames = []
-        for i in range(beg, end):
-            data = self.section.load_section(i)
-            tmptype = data[0:4]
-            if tmptype in ["FLIS", "FCIS", "FDST", "DATP"]:
-                imgnames.append(None)
-                continue
-            elif tmptype == "SRCS":
-                imgnames.append(None)
-                continue
-            elif tmptype == "CMET":
-                imgnames.append(None)
-                continue
-            elif tmptype == "FONT":
-                imgnames.append(None)
-                continue
-            elif tmptype == "RESC":
-                imgnames.append(None)
-                continue
-            if data == chr(0xe9) + chr(0x8e) + "\r\n":
-                imgnames.append(None)
-                continue
-            imgtype = what(None, data)
-            if imgtype is None and data[0:2] == b'\xFF\xD8':
-                last = len(data)
-                while data[last-1:last] == b'\x00':
-                    last -= 1
-                if data[last-2:last] == b'\xFF\xD9':
-                    imgtype = "jpeg"
-            if imgtype is None:
-                imgnames.append(None)
-            else:
-                imgnames.append(i)
-            if len(imgnames)-1 == coverid:
-                return data
-        raise OSError
+        return self.container.read(*self.get_cover_location())
+
+    def get_thumb_image(self):
+        return None
+
+
+# Pick the reader from the signature rather than the extension, Kindle
+# stores KFX books under .azw names too.
+def open_ebook(path):
+    with open(path, 'rb') as file:
+        signature = file.read(4)
+    if signature == b'CONT':
+        return KFXFile(path)
+    return MOBIFile(path)
@@ -1,35 +1,275 @@
 import os
-import re
 import sys
+import copy
 import time
-import glob
-import string
-import sqlite3
-from pathlib import Path
+import json
+import queue
+import threading
+
+from collections import deque
+from contextlib import contextmanager
+
+import KindleUnpack
+from Device import get_device_bus, find_kindle_roots
+from Events import Event, TextSink
+from File import MOBIFile, open_ebook
+from Library import (
+    ORPHAN_CONFIDENCES, scan_documents, scan_thumbnails, is_ebook_name,
+    guess_asin, guess_sidecar_asin, parse_thumbnail_name,
+    find_orphan_thumbnails, read_ebook_header, is_damaged_thumbnail,
+    check_thumbnails
+)
+from Journal import Journal
+from Manifest import Manifest
+from Stats import Stats
+from Thumbnail import get_thumbnail_size, make_thumbnail
+
+
+# The functions below run on the worker pool, they must stay picklable.
+# The fingerprint of an ebook in the host cover cache, or None when there
+# is no cache or the ebook cannot be read.
+def get_cache_fingerprint(cache, path):
+    if cache is None:
+        return None
+    try:
+        return cache.get_fingerprint(path)
+    except OSError:
+        return None
+
+
+def get_ebook_metadata(path, size=None, cache=None):
+    asin = cdetype = cover = location = thumb_location = None
+
+    fingerprint = get_cache_fingerprint(cache, path)
+    if fingerprint is not None:
+        metadata = cache.get_metadata(fingerprint)
+        if metadata is not None:
+            location = metadata['cover']
+            cover = cache.get_cover(fingerprint, size) \
+                if location is not None else None
+            if location is None or cover is not None:
+                return (
+                    metadata['asin'], metadata['cdetype'], cover,
+                    tuple(location) if location is not None else None
+                )
+
+    try:
+        with open_ebook(path) as mobi_file:
+            asin = mobi_file.get_metadata('ASIN')
+            cdetype = mobi_file.get_metadata('Document Type')
+            location = mobi_file.get_cover_location()
+            thumb_location = mobi_file.get_thumb_location()
+            cover = mobi_file.get_cover_image()
+            if size is not None:
+                cover = make_thumbnail(
+                    cover, mobi_file.get_thumb_image(), size
+                )
+    except Exception:
+        return (asin, cdetype, cover, location)
+
+    if fingerprint is not None:
+        cache.set_metadata(
+            fingerprint, asin, cdetype, location, thumb_location
+        )
+        cache.set_cover(fingerprint, size, cover)
 
-from File import MOBIFile
+    return (asin, cdetype, cover, location)
+
+
+def read_ebook_cover(path, location):
+    if location is None:
+        return None
+    offset, length = location
+    try:
+        with open(path, 'rb') as file:
+            file.seek(offset)
+            KindleUnpack.count_read(length)
+            return file.read(length)
+    except OSError:
+        return None
+
+
+# Read what is needed to plan the work on an ebook, without its cover. What
+# the manifest knows about an unchanged ebook is reused.
+def get_ebook_header(path, book=None, cache=None):
+    if book is not None:
+        return (
+            book['asin'], book['cdetype'], book['cover'], book.get('thumb')
+        )
+
+    asin = cdetype = location = thumb_location = None
+
+    fingerprint = get_cache_fingerprint(cache, path)
+    if fingerprint is not None:
+        metadata = cache.get_metadata(fingerprint)
+        if metadata is not None:
+            return tuple(
+                tuple(value) if isinstance(value, list) else value
+                for value in (
+                    metadata['asin'], metadata['cdetype'],
+                    metadata['cover'], metadata['thumb']
+                )
+            )
+
+    try:
+        asin, cdetype, location, thumb_location = read_ebook_header(path)
+    except Exception:
+        return (asin, cdetype, location, thumb_location)
+
+    if fingerprint is not None:
+        cache.set_metadata(
+            fingerprint, asin, cdetype, location, thumb_location
+        )
+
+    return (asin, cdetype, location, thumb_location)
+
+
+def load_ebook_cover(path, location, thumb_location=None, size=None,
+                     cache=None):
+    fingerprint = get_cache_fingerprint(cache, path)
+    if fingerprint is not None:
+        cover = cache.get_cover(fingerprint, size)
+        if cover is not None:
+            return cover
+
+    cover = read_ebook_cover(path, location)
+    if size is not None:
+        cover = make_thumbnail(
+            cover, read_ebook_cover(path, thumb_location), size
+        )
+
+    if fingerprint is not None:
+        cache.set_cover(fingerprint, size, cover)
+
+    return cover
+
+
+# Rewrite a personal document as an EBOK in place, keeping its ASIN or
+# giving it one. Returns (asin, cdetype, converted); other cdetypes, KFX
+# and Print Replica books are left as they are.
+def convert_ebook(path, dry_run=False):
+    import DualMetaFix
+    from uuid import uuid4
+    if os.path.splitext(path)[1].lower() == '.azw4':
+        return (None, None, False)
+    with open_ebook(path) as ebook_file:
+        asin = ebook_file.get_metadata('ASIN')
+        cdetype = ebook_file.get_metadata('Document Type')
+        convertible = isinstance(ebook_file, MOBIFile)
+    if not convertible or cdetype != 'PDOC':
+        return (asin, cdetype, False)
+    asin = asin or guess_asin(os.path.basename(path)) or str(uuid4())
+    if not dry_run:
+        DualMetaFix.DualMobiMetaFix(path, None, asin.encode('utf-8'))
+    return (asin, cdetype, True)
+
+
+# Run a job and return its wall time and the I/O it did along its result.
+def run_timed_job(func, *args):
+    counters = KindleUnpack.io_counters
+    sections = getattr(counters, 'sections', 0)
+    length = getattr(counters, 'bytes', 0)
+    start = time.perf_counter()
+    try:
+        result = func(*args)
+    except Exception:
+        result = None
+    return (
+        time.perf_counter() - start,
+        getattr(counters, 'sections', 0) - sections,
+        getattr(counters, 'bytes', 0) - length,
+        result,
+    )
 
 
 class FixCover:
     name = 'Fix Kindle Ebook Cover'
     version = '1.2'
     feedback = 'https://bookfere.com/post/994.html'
+    db_timeout = 30
+    db_retries = 5
+    db_batch_size = 100
+    thumbnail_batch_size = 256
+    quarantine_name = '.fix_kindle_ebook_cover.quarantine'
+    watch_debounce = 2.0
+    watch_interval = 5.0
     description = '%s - v%s\nA tool to fix damaged Kindle ebook covers.\n\
 Feedback: %s' % (name, version, feedback)
 
-    def __init__(self, logger=None, progress=None, db=None):
+    def __init__(self, logger=None, progress=None, db=None, manifest=False,
+                 jobs=1, executor='thread', thumbnail=None,
+                 durability='none', plan=False, stats=None, profile=False,
+                 events=None, resume=False, devices=1, per_bus=1,
+                 cache=None, cache_size=1024, confidence='high',
+                 quarantine=False):
         self.logger = logger
         self.progress = progress
+        self.progress_done = 0
+
+        self.subscribers = []
+        self.emit_lock = threading.RLock()
+        self.cancelled = threading.Event()
+        if logger is not None:
+            self.subscribe(TextSink(logger))
+        if events is not None:
+            self.subscribe(events)
+
+        # True to log the statistics of a run as JSON, or a file path.
+        self.stats_output = stats if stats or not profile else True
+        self.stats = Stats(profile)
+
+        self.plan_only = plan
+
+        # none|file|batch
+        self.durability = durability
+        self.unsynced_thumbnails = []
+
+        self.thumbnail_size = get_thumbnail_size(thumbnail)
+
+        # A host directory of covers shared by runs on several Kindles, and
+        # its size limit in megabytes.
+        self.cover_cache = None
+        if cache is not None:
+            from CoverCache import CoverCache
+            self.cover_cache = CoverCache(cache, cache_size * 1024 * 1024)
+
+        self.jobs = jobs
+        self.executor = executor
+
+        # Kindle roots processed at once, and at once on the same bus.
+        self.devices = devices
+        self.per_bus = max(1, per_bus)
+
+        self.use_manifest = manifest
+        self.manifest = None
+
+        self.resume = resume
+        self.journal = None
+
+        # The least sure orphans a clean removes, and whether it moves them
+        # aside instead of deleting them.
+        self.clean_confidence = confidence
+        self.quarantine = quarantine
 
         self.guessed_asins = []
+        self.sidecars = []
+        self.ebook_stats = dict()
+        # The ebook of every EBOK ASIN seen, to fix a thumbnail going bad.
+        self.ebook_asins = dict()
 
         # Only for KUAL extention
         self.db_access = False
+        self.db_updates = []
         db_path = db if db is not None else '/var/local/cc.db'
         if (os.path.exists(db_path)):
+            import sqlite3
             self.db_access = True
+            # Transactions are explicit, and waiting for the lock held by the
+            # Kindle framework is bounded by the busy timeout.
             self.db_connection = sqlite3.connect(
                 db_path,
+                timeout=self.db_timeout,
+                isolation_level=None,
                 check_same_thread=False
             )
             self.db_cursor = self.db_connection.cursor()
@@ -37,30 +277,75 @@ Feedback: %s' % (name, version, feedback)
         self.log('Time: %s' % time.strftime('%Y-%m-%d %H:%M:%S'))
         self.log(self.description, True)
 
+    # Stop the running job between two ebooks.
+    def cancel(self):
+        self.cancelled.set()
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+
+    def emit(self, type, **data):
+        if len(self.subscribers) < 1:
+            return
+        event = Event(type, **data)
+        # Root workers share the subscribers, which are not thread safe.
+        with self.emit_lock:
+            for callback in self.subscribers:
+                callback(event)
+
+    # Run handle() on a thread and yield its events as they come.
+    def iter_events(self, action='fix', roots=[]):
+        events = queue.Queue()
+        self.subscribe(events.put)
+
+        def run():
+            try:
+                self.handle(action=action, roots=roots)
+            finally:
+                events.put(None)
+
+        threading.Thread(target=run, daemon=True).start()
+        try:
+            while True:
+                event = events.get()
+                if event is None:
+                    return
+                yield event
+        finally:
+            self.unsubscribe(events.put)
+
+    @contextmanager
+    def phase(self, name, timed=True):
+        self.emit('phase_started', phase=name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if timed:
+                self.stats.add_time(name, seconds)
+            self.emit('phase_finished', phase=name, seconds=seconds)
+
     def log(self, text, sep=False):
-        if self.logger is not None:
-            divider = '-------------------------------------------'
-            text = '%s\n%s\n%s' % (divider, text, divider) \
-                if sep is True else text
-            self.logger(text)
+        self.emit('message', text=text, sep=sep is True)
 
+    # factor is the number of steps of the current job, 0 means finished.
     def print_progress(self, factor):
         if self.progress is not None:
             self.progress(factor)
-
-    def get_filepath_list(self, path):
-        return glob.glob('%s%s**' % (path, os.sep), recursive=True)
+        self.progress_done = self.progress_done + 1 if factor > 0 else 0
+        self.emit(
+            'progress', done=self.progress_done if factor > 0 else None,
+            total=factor if factor > 0 else None,
+            bytes=self.stats.counters.get('bytes_read', 0)
+            + self.stats.counters.get('bytes_written', 0)
+        )
 
     def get_ebook_thumbnails_via_path(self, path):
-        thumbnails = dict()
-        for thumbnail in self.get_filepath_list(path):
-            asin = re.match(
-                rf'.*{re.escape(os.sep)}thumbnail_(.+?)[_\.].+',
-                thumbnail
-            )
-            if asin is not None:
-                thumbnails[asin.group(1)] = thumbnail
-        return thumbnails
+        return scan_thumbnails(path)
 
     def get_ebook_thumbnails_via_db(self):
         # self.db_cursor.row_factory = lambda cursor, row: row[0]
@@ -68,91 +353,264 @@ Feedback: %s' % (name, version, feedback)
             SELECT p_thumbnail FROM Entries \
             WHERE p_thumbnail IS NOT NULL \
             AND p_location IS NOT NULL')
-        return [row[0] for row in thumbnails.fetchall()]
+        return (row[0] for row in thumbnails)
 
-    def is_damaged_thumbnail(self, path):
-        try:
-            return os.path.getsize(path) < 2000
-        except Exception:
-            return False
+    def is_damaged_thumbnail(self, path, stat=None):
+        return is_damaged_thumbnail(
+            path, stat.st_size if stat is not None else None
+        )
 
+    # The thumbnails are checked in batches on the worker pool, with the
+    # sizes the scan already has.
     def get_damaged_thumbnails(self, path):
-        thumbnails = self.get_ebook_thumbnails_via_path(path)
-        for thumbnail in thumbnails.copy():
-            thumbnail_path = thumbnails[thumbnail]
-            if not self.is_damaged_thumbnail(thumbnail_path):
-                del thumbnails[thumbnail]
+        with self.phase('discovery'):
+            index = self.get_ebook_thumbnails_via_path(path)
+        entries = [entry for entries in index.values() for entry in entries]
+        batches = (
+            entries[start:start + self.thumbnail_batch_size]
+            for start in range(0, len(entries), self.thumbnail_batch_size)
+        )
+        thumbnails = dict()
+        with self.phase('health_check'):
+            results = self.map_jobs(
+                check_thumbnails, batches,
+                lambda batch: ([
+                    (entry.path, entry.stat.st_size) for entry in batch
+                ],), phase='health_check'
+            )
+            for batch, damaged in results:
+                for entry, is_damaged in zip(batch, damaged or []):
+                    if is_damaged:
+                        thumbnails.setdefault(entry.asin, []).append(entry)
         return thumbnails
 
     def is_valid_ebook_file(self, filename):
-        for ext in ['.mobi', '.azw', '.azw3', 'azw4']:
-            if filename.endswith(ext):
-                return True
-        return False
+        return is_ebook_name(filename)
 
     def get_ebook_list_via_path(self, path):
-        ebook_list = []
-        for filename in self.get_filepath_list(path):
-            self.get_ebook_asisn_from_filename(filename)
-            if not self.is_valid_ebook_file(filename):
-                continue
-            ebook_list.append(filename)
+        ebook_list, guessed_asins, self.sidecars = scan_documents(path)
+        self.guessed_asins.extend(guessed_asins)
         return ebook_list
 
     def get_ebook_asisn_from_filename(self, filename):
-        asin = re.search(
-            r'_([\w-]*)\.(?:kfx|azw\d{0,1}|prc|[mp]obi)$',
-            filename
-        )
+        asin = guess_asin(filename)
         if asin is not None:
-            self.guessed_asins.append(asin.group(1))
+            self.guessed_asins.append(asin)
 
+    # Streamed from a cursor of its own, the batched updates run on
+    # db_cursor while the rows are iterated and would reset the query.
     def get_ebook_list_via_db(self):
-        ebook_list = self.db_cursor.execute(" \
+        return self.db_connection.execute(" \
             SELECT p_uuid, p_location, p_thumbnail, p_cdeType FROM Entries \
             WHERE p_cdeType IN ('PDOC', 'EBOK') \
             AND p_location IS NOT NULL")
-        return ebook_list.fetchall()
+
+    def is_same_thumbnail(self, path, data):
+        import hashlib
+        try:
+            if os.path.getsize(path) != len(data):
+                return False
+            digest = hashlib.sha1()
+            with open(path, 'rb') as file:
+                for chunk in iter(lambda: file.read(65536), b''):
+                    digest.update(chunk)
+        except OSError:
+            return False
+        return digest.digest() == hashlib.sha1(data).digest()
 
     def store_ebook_thumbnail(self, path, data):
-        with open(path, 'wb') as file:
-            file.write(data)
+        with self.stats.phase('thumbnail_write'):
+            written = self.write_thumbnail(path, data)
+        self.stats.count(
+            'bytes_written' if written else 'bytes_unchanged', len(data)
+        )
+        return written
 
-    def get_ebook_metadata(self, path):
-        asin = cdetype = cover = None
+    # Write to a hidden temporary file and rename it into place, so an
+    # interrupted write never leaves a damaged thumbnail behind.
+    def write_thumbnail(self, path, data):
+        if self.is_same_thumbnail(path, data):
+            return False
 
+        directory, name = os.path.split(path)
+        temp_path = os.path.join(directory, '.%s.tmp' % name)
         try:
-            mobi_file = MOBIFile(path)
-            asin = mobi_file.get_metadata('ASIN')
-            cdetype = mobi_file.get_metadata('Document Type')
-            cover = mobi_file.get_cover_image()
-        except Exception:
+            with open(temp_path, 'wb') as file:
+                file.write(data)
+                if self.durability == 'file':
+                    file.flush()
+                    os.fsync(file.fileno())
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        if self.durability == 'file':
+            self.sync_directory(directory)
+        elif self.durability == 'batch':
+            self.unsynced_thumbnails.append(path)
+        return True
+
+    def sync_directory(self, path):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
             pass
+        finally:
+            os.close(fd)
+
+    # Flush the thumbnails written in "batch" durability all at once.
+    def sync_thumbnails(self):
+        if len(self.unsynced_thumbnails) < 1:
+            return
+        with self.stats.phase('sync'):
+            self.sync_files(self.unsynced_thumbnails)
+        self.unsynced_thumbnails = []
+
+    def sync_files(self, paths):
+        if hasattr(os, 'sync'):
+            os.sync()
+        else:
+            for path in paths:
+                try:
+                    with open(path, 'rb+') as file:
+                        os.fsync(file.fileno())
+                except OSError:
+                    pass
 
-        return (asin, cdetype, cover)
+    def get_ebook_metadata(self, path):
+        return get_ebook_metadata(path, self.thumbnail_size, self.cover_cache)
+
+    def read_ebook_cover(self, path, location):
+        return read_ebook_cover(path, location)
+
+    # Run func over items on the worker pool and yield (item, result) in
+    # the order of items, only a bounded number of jobs are in flight.
+    def map_jobs(self, func, items, key=lambda item: (item,), jobs=None,
+                 phase=None):
+        jobs = jobs if jobs is not None else self.jobs
+        if jobs < 2:
+            for item in items:
+                yield (item, self.get_job_result(
+                    run_timed_job(func, *key(item)), phase
+                ))
+            return
+
+        import concurrent.futures
+        executor_class = concurrent.futures.ProcessPoolExecutor \
+            if self.executor == 'process' \
+            else concurrent.futures.ThreadPoolExecutor
+        with executor_class(max_workers=jobs) as executor:
+            pending = deque()
+            for item in items:
+                pending.append((
+                    item, executor.submit(run_timed_job, func, *key(item))
+                ))
+                if len(pending) >= jobs * 2:
+                    item, future = pending.popleft()
+                    yield (item, self.get_job_result(future, phase))
+            while len(pending) > 0:
+                item, future = pending.popleft()
+                yield (item, self.get_job_result(future, phase))
+
+    def get_job_result(self, job, phase=None):
+        try:
+            job = job.result() if hasattr(job, 'result') else job
+        except Exception:
+            return None
+        seconds, sections, length, result = job
+        if phase is not None:
+            self.stats.record_latency(phase, seconds)
+        self.stats.count('sections_loaded', sections)
+        self.stats.count('bytes_read', length)
+        return result
 
     def get_thumbnail_name(self, asin, cdetype):
         return 'thumbnail_%s_%s_portrait.jpg' % (asin, cdetype)
 
-    def fix_via_db(self, thumbnails_path):
-        for row in self.get_ebook_list_via_db():
-            p_uuid, p_location, p_thumbnail, p_cde = row
-            if not os.path.exists(p_location):
+    def update_db_thumbnail(self, thumbnail_path, p_location):
+        self.db_updates.append((thumbnail_path, p_location))
+        if len(self.db_updates) >= self.db_batch_size:
+            self.flush_db_updates()
+
+    # Apply the pending updates in one short transaction, retrying while
+    # the database is locked by the Kindle framework.
+    def flush_db_updates(self):
+        if len(self.db_updates) < 1:
+            return
+        with self.stats.phase('db_update'):
+            cursor = self.execute_db_updates()
+        self.stats.count('db_rows_updated', cursor.rowcount)
+        self.log('- Updated %d database entries.' % cursor.rowcount)
+        # A generated book is only done once the database knows about it.
+        for _, p_location in self.db_updates:
+            self.finish_book(p_location)
+        self.db_updates = []
+
+    def execute_db_updates(self):
+        import sqlite3
+        for attempt in range(self.db_retries):
+            try:
+                self.db_cursor.execute('BEGIN IMMEDIATE')
+            except sqlite3.OperationalError:
+                if attempt == self.db_retries - 1:
+                    raise
+                time.sleep(0.1 * 2 ** attempt)
                 continue
+            try:
+                cursor = self.db_connection.executemany(
+                    'UPDATE Entries SET p_thumbnail = ? WHERE p_location = ?',
+                    self.db_updates
+                )
+                self.db_cursor.execute('COMMIT')
+            except Exception:
+                self.db_cursor.execute('ROLLBACK')
+                raise
+            return cursor
+
+    def is_finished_book(self, path, stat=None):
+        if self.journal is None or not self.journal.is_done(path, stat):
+            return False
+        self.stats.count('books_resumed')
+        return True
 
-            asin, cde, cover = self.get_ebook_metadata(p_location)
+    def begin_book(self, path, thumbnails):
+        if self.journal is not None:
+            self.journal.begin(path, thumbnails)
+
+    def finish_book(self, path, stat=None):
+        if self.journal is not None:
+            self.journal.finish(path, stat)
+
+    def fix_via_db(self, thumbnails_path, jobs=None):
+        rows = (
+            row for row in self.get_ebook_list_via_db()
+            if os.path.exists(row[1]) and not self.is_finished_book(row[1])
+        )
+        results = self.map_jobs(
+            get_ebook_metadata, rows,
+            lambda row: (row[1], self.thumbnail_size, self.cover_cache),
+            jobs, 'metadata'
+        )
+        for row, metadata in self.stats.timed(results, 'metadata'):
+            if self.cancelled.is_set():
+                break
+            p_uuid, p_location, p_thumbnail, p_cde = row
+            asin, cde, cover, _ = metadata or (None, None, None, None)
 
             if p_location.endswith('KUAL.kual'):
-                cover = Path(
-                    os.path.join(os.path.dirname(__file__), 'kual.jpg')
-                ).read_bytes()
+                with open(os.path.join(
+                        os.path.dirname(__file__), 'kual.jpg'), 'rb') as file:
+                    cover = file.read()
             elif not self.is_valid_ebook_file(p_location):
                 continue
             elif cover is None:
-                self.failure_jobs['ebook_errors'].append(
-                    '%s\n  └─[%s] %s' %
-                    ('No cover was found.', p_cde, Path(p_location).name)
-                )
+                self.add_cover_error(p_cde, p_location)
                 continue
 
             if p_thumbnail is None and p_cde in ('EBOK', 'PDOC'):
@@ -162,72 +620,239 @@ Feedback: %s' % (name, version, feedback)
                     thumbnails_path,
                     self.get_thumbnail_name(asin, cde)
                 )
+                self.begin_book(p_location, [thumbnail_path])
                 self.store_ebook_thumbnail(thumbnail_path, cover)
-                self.db_cursor.execute('UPDATE Entries SET p_thumbnail = ? \
-                    WHERE p_location = ?', (thumbnail_path, p_location))
-                self.log(
-                    '✓ Generated: %s\n  └─[%s] %s' %
-                    (Path(thumbnail_path).name, p_cde, Path(p_location).name)
+                self.update_db_thumbnail(thumbnail_path, p_location)
+                self.stats.count('books_generated')
+                self.emit(
+                    'book_generated', thumbnail=thumbnail_path,
+                    ebook=p_location, cdetype=p_cde
                 )
             elif p_thumbnail is not None and (
                 not os.path.exists(p_thumbnail)
                 or self.is_damaged_thumbnail(p_thumbnail)
             ):
+                self.begin_book(p_location, [p_thumbnail])
                 self.store_ebook_thumbnail(p_thumbnail, cover)
-                self.log(
-                    '✓ Fixed: %s\n  └─[%s] %s' %
-                    (Path(p_thumbnail).name, p_cde, Path(p_location).name)
+                self.finish_book(p_location)
+                self.stats.count('books_fixed')
+                self.emit(
+                    'book_fixed', thumbnail=p_thumbnail,
+                    ebook=p_location, cdetype=p_cde
                 )
+            else:
+                self.stats.count('books_skipped')
+
+        self.flush_db_updates()
 
-    def fix_via_path(self, thumbnails, documents_path, thumbnails_path):
-        ebook_list = self.get_ebook_list_via_path(documents_path)
+    def fix_via_path(self, thumbnails, documents_path, thumbnails_path,
+                     jobs=None):
+        with self.phase('planning', False):
+            plan = self.plan_via_path(
+                thumbnails, documents_path, thumbnails_path, jobs
+            )
+
+        if self.plan_only:
+            self.emit('plan', plan={
+                'documents': documents_path,
+                'thumbnails': thumbnails_path,
+                'read': sum(item['read'] for item in plan),
+                'write': sum(item['write'] for item in plan),
+                'actions': plan,
+            })
+            return
+
+        if self.cancelled.is_set():
+            return
+
+        with self.phase('execution', False):
+            self.execute_plan(plan, jobs)
+
+        self.failure_jobs['cover_errors'] = [
+            thumbnail.name for entries in thumbnails.values()
+            for thumbnail in entries
+        ]
+
+        if self.manifest is not None:
+            self.manifest.save(prune=not self.cancelled.is_set())
+
+        self.print_progress(0)
+
+    # Decide what to do with every ebook (generate, fix or skip) before
+    # anything is written. Ebooks sharing an ASIN get their cover once.
+    def plan_via_path(self, thumbnails, documents_path, thumbnails_path,
+                      jobs=None):
+        with self.phase('discovery'):
+            ebook_list = self.get_ebook_list_via_path(documents_path)
+        factor = len(ebook_list) * 2
+
+        tasks = []
+        plan = []
+        self.ebook_stats = dict()
         for ebook in ebook_list:
-            self.print_progress(len(ebook_list))
+            book = None
+            if self.manifest is not None:
+                book = self.manifest.get_book(ebook.path, ebook.stat)
+            self.ebook_stats[ebook.path] = ebook.stat
+            if self.is_finished_book(ebook.path, ebook.stat):
+                self.print_progress(factor)
+                item = self.get_plan_item(ebook)
+                item['reason'] = 'resumed'
+                plan.append(item)
+                continue
+            tasks.append((ebook, book))
 
-            asin, cdetype, cover = self.get_ebook_metadata(ebook)
-            ebook = Path(ebook)
+        planned_asins = set()
+        results = self.map_jobs(
+            get_ebook_header, tasks,
+            lambda task: (task[0].path, task[1], self.cover_cache),
+            jobs, 'metadata'
+        )
+        for (ebook, book), header in self.stats.timed(results, 'metadata'):
+            if self.cancelled.is_set():
+                break
+            self.print_progress(factor)
+
+            asin, cdetype, cover, thumb = header or (None, None, None, None)
+            item = self.get_plan_item(ebook, asin, cdetype, cover, thumb)
+            plan.append(item)
+            if asin is not None and cdetype == 'EBOK':
+                self.ebook_asins[asin] = ebook.path
+
+            if book is not None and asin not in thumbnails \
+                    and self.manifest.is_thumbnail_intact(book):
+                item['reason'] = 'unchanged'
+            elif cover is None:
+                item['reason'] = 'no cover'
+            elif cdetype != 'EBOK' or asin is None:
+                item['reason'] = 'not EBOK'
+            elif asin in planned_asins:
+                item['reason'] = 'duplicate'
+            elif asin in thumbnails.keys():
+                item['action'] = 'fix'
+                item['thumbnails'] = [
+                    thumbnail.path for thumbnail in thumbnails.pop(asin)
+                ]
+            else:
+                thumbnail_path = os.path.join(
+                    thumbnails_path, self.get_thumbnail_name(asin, cdetype)
+                )
+                item['thumbnails'] = [thumbnail_path]
+                if os.path.exists(thumbnail_path):
+                    item['reason'] = 'exists'
+                else:
+                    item['action'] = 'generate'
+
+            if item['reason'] != 'unchanged' and cover is not None \
+                    and cdetype == 'EBOK':
+                planned_asins.add(asin)
+
+            if item['action'] != 'skip':
+                item['read'] = cover[1]
+                if self.thumbnail_size is not None and thumb is not None:
+                    item['read'] += thumb[1]
+                item['write'] = cover[1] * len(item['thumbnails'])
+
+        return plan
+
+    def get_plan_item(self, ebook, asin=None, cdetype=None, cover=None,
+                      thumb=None):
+        return {
+            'action': 'skip',
+            'reason': None,
+            'ebook': ebook.path,
+            'size': ebook.stat.st_size,
+            'asin': asin,
+            'cdetype': cdetype,
+            'cover': cover,
+            'thumb': thumb,
+            'thumbnails': [],
+            'read': 0,
+            'write': 0,
+        }
+
+    # Run the planned actions ordered by directory and file size, which
+    # keeps the reads sequential on slow USB media.
+    def execute_plan(self, plan, jobs=None):
+        factor = len(plan) * 2
+
+        actions = []
+        for item in plan:
+            if item['action'] != 'skip':
+                actions.append(item)
+                continue
+            self.print_progress(factor)
+            self.stats.count('books_skipped')
+            if item['reason'] == 'resumed':
+                continue
+            if item['cover'] is None:
+                self.add_cover_error(item['cdetype'], item['ebook'])
+            if item['reason'] != 'unchanged':
+                self.record_plan_item(item)
+
+        actions.sort(
+            key=lambda item: (os.path.dirname(item['ebook']), item['size'])
+        )
+        results = self.map_jobs(
+            load_ebook_cover, actions,
+            lambda item: (
+                item['ebook'], item['cover'], item['thumb'],
+                self.thumbnail_size, self.cover_cache
+            ), jobs, 'cover_extraction'
+        )
+        for item, cover in self.stats.timed(results, 'cover_extraction'):
+            if self.cancelled.is_set():
+                break
+            self.print_progress(factor)
 
             if cover is None:
-                self.failure_jobs['ebook_errors'].append(
-                    '%s\n  └─[%s] %s' %
-                    ('No cover was found.', cdetype, ebook.name)
-                )
+                self.add_cover_error(item['cdetype'], item['ebook'])
                 continue
 
-            if cdetype == 'EBOK' and asin in thumbnails.keys():
-                thumbnail_path = thumbnails[asin]
-                thumbnail_name = Path(thumbnail_path).name
+            event = 'book_fixed' if item['action'] == 'fix' \
+                else 'book_generated'
+            self.begin_book(item['ebook'], item['thumbnails'])
+            for thumbnail_path in item['thumbnails']:
                 self.store_ebook_thumbnail(thumbnail_path, cover)
-                self.log(
-                    '✓ Fixed: %s\n  └─[%s] %s' %
-                    (thumbnail_name, cdetype, ebook.name)
+                self.emit(
+                    event, thumbnail=thumbnail_path, ebook=item['ebook'],
+                    cdetype=item['cdetype']
                 )
                 self.conquest_jobs += 1
-                del thumbnails[asin]
-            elif cdetype == 'EBOK' and asin is not None:
-                thumbnail_name = self.get_thumbnail_name(asin, cdetype)
-                thumbnail_path = os.path.join(thumbnails_path, thumbnail_name)
-                if not os.path.exists(thumbnail_path):
-                    self.store_ebook_thumbnail(thumbnail_path, cover)
-                    self.log(
-                        '✓ Generated: %s\n  └─[%s] %s' %
-                        (thumbnail_name, cdetype, ebook.name)
-                    )
-                    self.conquest_jobs += 1
+            self.stats.count(
+                'books_fixed' if item['action'] == 'fix'
+                else 'books_generated'
+            )
 
-        self.failure_jobs['cover_errors'] = [
-            Path(thumbnail).name for thumbnail in thumbnails.values()
-        ]
+            self.finish_book(item['ebook'], self.ebook_stats[item['ebook']])
+            self.record_plan_item(item)
 
-        self.print_progress(0)
+    def record_plan_item(self, item):
+        if self.manifest is None:
+            return
+        self.manifest.set_book(
+            item['ebook'], self.ebook_stats[item['ebook']], item['asin'],
+            item['cdetype'], item['cover'],
+            item['thumbnails'][0] if len(item['thumbnails']) > 0 else None,
+            item['thumb']
+        )
+
+    def add_cover_error(self, cdetype, ebook):
+        self.stats.count('books_failed')
+        self.emit('cover_missing', ebook=ebook, cdetype=cdetype)
+        self.failure_jobs['ebook_errors'].append(
+            '%s\n  └─[%s] %s' %
+            ('No cover was found.', cdetype, os.path.basename(ebook))
+        )
 
     def fix_ebook_thumbnails(self, documents_path, thumbnails_path):
         self.log('Checking damaged ebook covers:', True)
         thumbnails = self.get_damaged_thumbnails(thumbnails_path)
 
-        if len(thumbnails) > 1:
-            for thumbnail in thumbnails:
-                self.log('- %s' % Path(thumbnail).name)
+        if len(thumbnails) > 0:
+            for entries in thumbnails.values():
+                for thumbnail in entries:
+                    self.log('- %s' % thumbnail.name)
         else:
             self.log('- No damaged ebook cover detected.')
 
@@ -240,11 +865,23 @@ Feedback: %s' % (name, version, feedback)
         }
 
         # Only for KUAL extention
-        if self.db_access:
-            self.fix_via_db(thumbnails_path)
+        if self.db_access and self.plan_only:
+            self.log('- A plan is only available without the database.')
+            return
+        elif self.db_access:
+            with self.phase('database', False):
+                self.fix_via_db(thumbnails_path)
         else:
             self.fix_via_path(thumbnails, documents_path, thumbnails_path)
 
+        if self.plan_only:
+            return
+
+        self.sync_thumbnails()
+
+        if self.cancelled.is_set():
+            return
+
         if self.failure_jobs is None:
             self.log('- No ebook cover to fix.')
             return
@@ -266,43 +903,165 @@ Feedback: %s' % (name, version, feedback)
         else:
             self.log('- No ebook cover need to fix.')
 
+    def convert_ebooks(self, documents_path, jobs=None):
+        self.log('Converting personal documents to ebooks:', True)
+
+        with self.phase('discovery'):
+            ebook_list = self.get_ebook_list_via_path(documents_path)
+        factor = len(ebook_list)
+
+        converted = 0
+        results = self.map_jobs(
+            convert_ebook, ebook_list,
+            lambda ebook: (ebook.path, self.plan_only), jobs, 'conversion'
+        )
+        for ebook, result in self.stats.timed(results, 'conversion'):
+            if self.cancelled.is_set():
+                break
+            self.print_progress(factor)
+
+            if result is None:
+                self.stats.count('books_failed')
+                self.log(
+                    '! Can not convert: %s' % os.path.basename(ebook.path)
+                )
+                continue
+            asin, cdetype, changed = result
+            if not changed:
+                self.stats.count('books_skipped')
+                continue
+            converted += 1
+            self.stats.count('books_converted')
+            self.emit(
+                'book_converted', ebook=ebook.path, asin=asin,
+                cdetype=cdetype
+            )
+
+        self.print_progress(0)
+
+        if converted < 1:
+            self.log('- No personal document to convert.')
+        elif self.plan_only:
+            self.log('- %d personal documents would be converted.' % converted)
+        else:
+            self.log('✓ %d personal documents converted.' % converted)
+
+    # The thumbnails of a database are orphans when no entry refers to
+    # them, otherwise from an index of the ebooks on the Kindle.
     def clean_orphan_thumbnails(self, documents_path, thumbnails_path):
         self.log('Analysing orphan ebook covers:', True)
 
-        thumbnails = self.get_ebook_thumbnails_via_path(thumbnails_path)
+        with self.phase('discovery'):
+            thumbnails = self.get_ebook_thumbnails_via_path(thumbnails_path)
 
         if self.db_access:
-            thumbnails = set(thumbnails.values()) \
-                - set(self.get_ebook_thumbnails_via_db())
+            with self.phase('cleanup'):
+                known = set(self.get_ebook_thumbnails_via_db())
+            orphans = [
+                (thumbnail, 'high') for entries in thumbnails.values()
+                for thumbnail in entries if thumbnail.path not in known
+            ]
         else:
-            self.log(
-                'This feature Removed due to impossible to delete the orphan'
-                'thumbnails perfectly.'
+            orphans = self.get_orphan_thumbnails_via_path(
+                thumbnails, documents_path
             )
-            return
-            # ebook_list = self.get_ebook_list_via_path(documents_path)
-            # for ebook in ebook_list:
-            #     self.print_progress(len(ebook_list))
-            #     asin, cdetype, cover = self.get_ebook_metadata(ebook)
-            #     if cdetype == 'EBOK' and asin in thumbnails.keys():
-            #         del thumbnails[asin]
-            # for asin in self.guessed_asins:
-            #     if asin in thumbnails.keys():
-            #         del thumbnails[asin]
-            # thumbnails = thumbnails.values()
 
         self.print_progress(0)
 
-        if len(thumbnails) < 1:
+        if self.cancelled.is_set():
+            return
+
+        levels = ORPHAN_CONFIDENCES[
+            :ORPHAN_CONFIDENCES.index(self.clean_confidence) + 1
+        ]
+        quarantine_path = self.get_quarantine_path(thumbnails_path) \
+            if self.quarantine else None
+
+        if self.plan_only:
+            self.emit('plan', plan={
+                'thumbnails': thumbnails_path,
+                'actions': [{
+                    'thumbnail': thumbnail.path,
+                    'confidence': confidence,
+                    'action': 'keep' if confidence not in levels
+                    else 'quarantine' if self.quarantine else 'delete',
+                } for thumbnail, confidence in orphans],
+            })
+            return
+
+        if len(orphans) < 1:
             self.log('- No orphan cover detected.')
             return
 
-        for thumbnail in thumbnails:
-            thumbnail_path = Path(thumbnail)
-            thumbnail_path.unlink(True)
-            self.log('✓ Delete: %s' % thumbnail_path.name)
+        with self.phase('cleanup'):
+            for thumbnail, confidence in orphans:
+                if confidence not in levels:
+                    self.stats.count('thumbnails_kept')
+                    self.log('* %s is kept (%s confidence).' % (
+                        thumbnail.name, confidence
+                    ))
+                    continue
+                if quarantine_path is not None:
+                    os.makedirs(quarantine_path, exist_ok=True)
+                    os.replace(thumbnail.path, os.path.join(
+                        quarantine_path, thumbnail.name
+                    ))
+                else:
+                    try:
+                        os.remove(thumbnail.path)
+                    except FileNotFoundError:
+                        pass
+                self.stats.count('thumbnails_deleted')
+                self.emit(
+                    'orphan_deleted', thumbnail=thumbnail.path,
+                    confidence=confidence, quarantine=quarantine_path
+                )
 
-        self.log('✓ All orphan ebook covers deleted.')
+        if quarantine_path is not None:
+            self.log('✓ Orphan ebook covers moved to %s.' % quarantine_path)
+        else:
+            self.log('✓ All orphan ebook covers deleted.')
+
+    # Index the ASIN and cdetype of every ebook, reusing the manifest and
+    # the cover cache, along with the ASINs in file and sidecar names.
+    def get_orphan_thumbnails_via_path(self, thumbnails, documents_path):
+        with self.phase('discovery'):
+            ebook_list = self.get_ebook_list_via_path(documents_path)
+        factor = len(ebook_list)
+
+        tasks = [
+            (ebook, self.manifest.get_book(ebook.path, ebook.stat)
+             if self.manifest is not None else None)
+            for ebook in ebook_list
+        ]
+        books = set()
+        results = self.map_jobs(
+            get_ebook_header, tasks,
+            lambda task: (task[0].path, task[1], self.cover_cache),
+            phase='metadata'
+        )
+        for _, header in self.stats.timed(results, 'metadata'):
+            if self.cancelled.is_set():
+                break
+            self.print_progress(factor)
+            if header is not None:
+                books.add(header[:2])
+
+        names = set(self.guessed_asins)
+        names.update(
+            guess_sidecar_asin(os.path.basename(path))
+            for path in self.sidecars
+        )
+        names.discard(None)
+        return find_orphan_thumbnails(thumbnails, books, names)
+
+    # Quarantined thumbnails are moved next to the journal and manifest,
+    # out of the thumbnails directory.
+    def get_quarantine_path(self, thumbnails_path):
+        return os.path.join(
+            os.path.dirname(os.path.dirname(thumbnails_path)),
+            self.quarantine_name
+        )
 
     def get_kindle_path(self, path):
         return (
@@ -317,24 +1076,38 @@ Feedback: %s' % (name, version, feedback)
         return True
 
     def get_kindle_root_automatically(self):
-        drives = []
-        roots = []
-
-        if sys.platform.startswith('win'):
-            drives = ['%s:\\' % s.upper() for s in string.ascii_lowercase[:26]]
-            drives.reverse()
-        elif sys.platform.startswith('darwin'):
-            drives = glob.glob('/Volumes/*')
-
-        for drive in drives:
-            path = os.path.join('%s' % drive)
-            if self.is_kindle_root(path):
-                roots.append(path)
+        return find_kindle_roots(self.is_kindle_root)
 
-        return roots
-
-    # fix|clean
+    # fix|clean|convert
     def handle(self, action='fix', roots=[]):
+        self.cancelled.clear()
+        self.progress_done = 0
+        self.stats = Stats(self.stats.profile)
+        self.stats.start_profile()
+        self.emit('run_started', action=action, roots=roots)
+        try:
+            self.handle_roots(action, roots)
+        finally:
+            self.evict_cover_cache()
+            self.emit_stats()
+            self.emit('run_finished', action=action)
+
+    def evict_cover_cache(self):
+        if self.cover_cache is not None:
+            self.stats.count('cache_evicted', self.cover_cache.evict())
+
+    def emit_stats(self):
+        profile = self.stats.stop_profile()
+        if not self.stats_output:
+            return
+        report = self.stats.report(profile)
+        if self.stats_output is True:
+            self.emit('stats', stats=report)
+            return
+        with open(self.stats_output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+
+    def handle_roots(self, action, roots):
         if not sys.version_info >= (3, 5):
             self.log(
                 'Rquired Python version >= 3.5\n' +
@@ -350,6 +1123,11 @@ Feedback: %s' % (name, version, feedback)
             self.log('You need choose a Kindle root directory first.')
             return
 
+        if action not in ('fix', 'clean', 'convert'):
+            self.log('Wrong action.')
+            return
+
+        valid_roots = []
         for root in roots:
             if root == '':
                 self.log('Kindle root directory can not be empty.')
@@ -359,21 +1137,253 @@ Feedback: %s' % (name, version, feedback)
                 self.log('%s is not a kindle root directory.' % root)
                 continue
 
-            self.log('Processing Kindle device: %s' % root)
+            valid_roots.append(root)
+
+        # The database belongs to the Kindle this runs on, one root only.
+        if self.devices > 1 and len(valid_roots) > 1 and not self.db_access:
+            self.handle_roots_concurrently(action, valid_roots)
+            return
+
+        for root in valid_roots:
+            self.handle_root(action, root)
 
-            documents_path, thumbnails_path = self.get_kindle_path(root)
+            if self.cancelled.is_set():
+                self.log('Cancelled.', True)
+                return
+
+            self.log('All jobs done.', True)
+
+    def handle_root(self, action, root):
+        self.log('Processing Kindle device: %s' % root)
 
+        documents_path, thumbnails_path = self.get_kindle_path(root)
+        self.manifest = Manifest(root) \
+            if self.use_manifest and not self.db_access else None
+
+        # Only fixing has books worth resuming, a clean is cheap to redo and
+        # a converted book is recognized as an EBOK. Without resume nothing
+        # is journaled.
+        self.journal = Journal(root, action, True) \
+            if self.resume and action == 'fix' and not self.plan_only \
+            else None
+        completed = False
+        try:
             if action == 'fix':
                 self.fix_ebook_thumbnails(documents_path, thumbnails_path)
             elif action == 'clean':
                 self.clean_orphan_thumbnails(documents_path, thumbnails_path)
-            else:
-                self.log('Wrong action.')
-                return
+            elif action == 'convert':
+                # Converted books need thumbnails named after EBOK.
+                self.convert_ebooks(documents_path)
+                if not self.cancelled.is_set() and not self.plan_only:
+                    self.fix_ebook_thumbnails(documents_path, thumbnails_path)
+            completed = not self.cancelled.is_set()
+        finally:
+            if self.journal is not None:
+                self.journal.close(completed)
+                self.journal = None
+
+    # Every root runs on its own worker with its own state, at most
+    # per_bus of them at once on a bus. Roots are queued alternating
+    # between buses so that a busy bus does not hold every worker.
+    def handle_roots_concurrently(self, action, roots):
+        from concurrent.futures import ThreadPoolExecutor
+        buses = dict()
+        for root in roots:
+            buses.setdefault(get_device_bus(root), []).append(root)
+        semaphores = dict(
+            (bus, threading.Semaphore(self.per_bus)) for bus in buses
+        )
+        ordered = []
+        for index in range(max(len(entries) for entries in buses.values())):
+            for bus, entries in buses.items():
+                if index < len(entries):
+                    ordered.append((bus, entries[index]))
+
+        reports = []
+        with ThreadPoolExecutor(max_workers=self.devices) as executor:
+            futures = [
+                (root, executor.submit(
+                    self.run_root_worker, action, root, semaphores[bus]
+                )) for bus, root in ordered
+            ]
+            for root, future in futures:
+                try:
+                    reports.append((root, future.result(), None))
+                except Exception as error:
+                    reports.append((root, None, error))
+
+        self.report_roots(reports)
+
+    def run_root_worker(self, action, root, semaphore):
+        with semaphore:
+            worker = self.get_root_worker()
+            start = time.perf_counter()
+            worker.handle_root(action, root)
+            worker.seconds = time.perf_counter() - start
+            return worker
+
+    # A shallow copy sharing the configuration, the subscribers and the
+    # cancel event, with the state of a run of its own.
+    def get_root_worker(self):
+        worker = copy.copy(self)
+        worker.stats = Stats()
+        worker.progress_done = 0
+        worker.unsynced_thumbnails = []
+        worker.manifest = None
+        worker.journal = None
+        worker.guessed_asins = []
+        worker.sidecars = []
+        worker.ebook_stats = dict()
+        worker.ebook_asins = dict()
+        worker.conquest_jobs = 0
+        worker.failure_jobs = None
+        return worker
+
+    def report_roots(self, reports):
+        self.log('Devices:', True)
+        for root, worker, error in reports:
+            if worker is None:
+                self.log('! %s: %s' % (root, error))
+                continue
+            self.stats.merge(worker.stats)
+            counters = worker.stats.counters
+            self.log('- %s: %d fixed, %d generated, %d without cover '
+                     '(%.1fs)' % (
+                         root, counters.get('books_fixed', 0),
+                         counters.get('books_generated', 0),
+                         counters.get('books_failed', 0), worker.seconds
+                     ))
+            self.emit(
+                'root_finished', root=root, seconds=worker.seconds,
+                counters=counters
+            )
+            self.ebook_asins.update(worker.ebook_asins)
+        self.log('Cancelled.' if self.cancelled.is_set() else
+                 'All jobs done.', True)
+
+    # Run a full fix, then fix the ebooks added and the thumbnails going bad
+    # as they change, until cancelled or interrupted.
+    def watch(self, roots=[]):
+        self.handle(action='fix', roots=roots)
+        roots = [roots] if type(roots) != list else roots
+        roots = [
+            root for root in roots or self.get_kindle_root_automatically()
+            if self.is_kindle_root(root)
+        ]
+        if len(roots) < 1 or self.cancelled.is_set():
+            return
 
-            self.log('All jobs done.', True)
+        paths = [path for root in roots for path in self.get_kindle_path(root)]
+        from Watcher import get_watcher, wait_changes
+        watcher = get_watcher(paths, self.watch_interval)
+        self.log('Watching for new ebooks and damaged covers: %s' %
+                 ', '.join(roots), True)
+        try:
+            while not self.cancelled.is_set():
+                changes = wait_changes(
+                    watcher, self.watch_debounce, self.cancelled
+                )
+                if changes is None:
+                    # Events were lost, only a full run catches up.
+                    self.handle(action='fix', roots=roots)
+                elif len(changes) > 0:
+                    self.handle_changes(roots, changes)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+
+    def handle_changes(self, roots, changes):
+        self.stats = Stats(self.stats.profile)
+        self.emit('run_started', action='watch', roots=roots)
+        self.conquest_jobs = 0
+        self.failure_jobs = {
+            'cover_errors': [],
+            'ebook_errors': [],
+        }
+        try:
+            for root in roots:
+                documents_path, thumbnails_path = self.get_kindle_path(root)
+                self.fix_changed_ebooks(
+                    self.get_changed_ebooks(
+                        changes, documents_path, thumbnails_path
+                    ), thumbnails_path
+                )
+            self.sync_thumbnails()
+        finally:
+            self.evict_cover_cache()
+            self.emit_stats()
+            self.emit('run_finished', action='watch')
+
+    # Map the ebooks to process to the damaged thumbnails they have to
+    # fix, an empty list for an added ebook.
+    def get_changed_ebooks(self, changes, documents_path, thumbnails_path):
+        ebooks = dict()
+        for path in changes:
+            directory, name = os.path.split(path)
+            if path.startswith(documents_path + os.sep) \
+                    and is_ebook_name(name) and os.path.isfile(path):
+                ebooks.setdefault(path, [])
+            elif directory == thumbnails_path \
+                    and parse_thumbnail_name(name) is not None \
+                    and self.is_damaged_thumbnail(path):
+                ebook = self.ebook_asins.get(parse_thumbnail_name(name)[0])
+                if ebook is None:
+                    self.failure_jobs['cover_errors'].append(name)
+                    self.log('* %s has no corresponding ebook.' % name)
+                    continue
+                ebooks.setdefault(ebook, []).append(path)
+        return ebooks
+
+    def fix_changed_ebooks(self, ebooks, thumbnails_path):
+        results = self.map_jobs(
+            get_ebook_metadata, ebooks.items(),
+            lambda item: (item[0], self.thumbnail_size, self.cover_cache),
+            phase='metadata'
+        )
+        for (ebook, thumbnails), metadata in self.stats.timed(
+                results, 'metadata'):
+            asin, cdetype, cover, _ = metadata or (None, None, None, None)
+            if cover is None:
+                self.add_cover_error(cdetype, ebook)
+                continue
+            if asin is None or cdetype != 'EBOK':
+                self.stats.count('books_skipped')
+                continue
+            self.ebook_asins[asin] = ebook
+
+            event = 'book_fixed'
+            if len(thumbnails) < 1:
+                thumbnail_path = os.path.join(
+                    thumbnails_path, self.get_thumbnail_name(asin, cdetype)
+                )
+                if not os.path.exists(thumbnail_path):
+                    event = 'book_generated'
+                elif not self.is_damaged_thumbnail(thumbnail_path):
+                    self.stats.count('books_skipped')
+                    continue
+                thumbnails = [thumbnail_path]
 
-    def __del__(self):
+            for thumbnail_path in thumbnails:
+                self.store_ebook_thumbnail(thumbnail_path, cover)
+                self.emit(
+                    event, thumbnail=thumbnail_path, ebook=ebook,
+                    cdetype=cdetype
+                )
+                self.conquest_jobs += 1
+            self.stats.count(
+                'books_fixed' if event == 'book_fixed' else 'books_generated'
+            )
+
+    def close(self):
         if (self.db_access):
-            self.db_connection.commit()
+            self.flush_db_updates()
             self.db_connection.close()
+            self.db_access = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,125 @@
+import os
+import json
+
+
+# An append-only record of the ebooks a run on a Kindle root has finished,
+# so that an interrupted run can be resumed where it stopped. A book is
+# begun before its thumbnails are written and done once they are; a book
+# begun but not done is processed again, after the temporary files its
+# writes may have left behind are removed. Only begin is flushed at once,
+# the done entries go out with the next begin or on close.
+class Journal:
+    filename = '.fix_kindle_ebook_cover.journal'
+
+    def __init__(self, root, action, resume=False):
+        self.root = root
+        self.action = action
+        self.path = os.path.join(root, self.filename)
+        self.done = dict()
+        self.pending = dict()
+        if resume:
+            self.load()
+            self.replay()
+        # Rewriting the loaded state also drops a line torn by a crash.
+        self.compact()
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                lines = file.readlines()
+        except OSError:
+            return
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get('op') == 'run' and entry.get('action') != self.action:
+                self.done.clear()
+                self.pending.clear()
+                return
+            key = entry.get('key')
+            if entry.get('op') == 'begin':
+                self.pending[key] = entry['thumbnails']
+            elif entry.get('op') == 'done':
+                self.done[key] = (entry['size'], entry['mtime_ns'])
+                self.pending.pop(key, None)
+
+    # Thumbnails are renamed into place, an interrupted write can only
+    # leave its hidden temporary file.
+    def replay(self):
+        for thumbnails in self.pending.values():
+            for name in thumbnails:
+                directory, name = os.path.split(os.path.join(self.root, name))
+                temp_path = os.path.join(directory, '.%s.tmp' % name)
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+        self.pending.clear()
+
+    def get_key(self, path):
+        return os.path.relpath(path, self.root).replace(os.sep, '/')
+
+    def append(self, entry, flush=False):
+        self.file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        if flush:
+            self.file.flush()
+
+    def begin(self, path, thumbnails):
+        self.append({
+            'op': 'begin',
+            'key': self.get_key(path),
+            'thumbnails': [self.get_key(name) for name in thumbnails],
+        }, True)
+
+    def finish(self, path, stat=None):
+        try:
+            stat = stat if stat is not None else os.stat(path)
+        except OSError:
+            return
+        key = self.get_key(path)
+        self.done[key] = (stat.st_size, stat.st_mtime_ns)
+        self.append({
+            'op': 'done',
+            'key': key,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+        })
+
+    def is_done(self, path, stat=None):
+        done = self.done.get(self.get_key(path))
+        if done is None:
+            return False
+        try:
+            stat = stat if stat is not None else os.stat(path)
+        except OSError:
+            return False
+        return done == (stat.st_size, stat.st_mtime_ns)
+
+    def compact(self):
+        temp_path = '%s.tmp' % self.path
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                file.write(json.dumps({'op': 'run', 'action': self.action}))
+                file.write('\n')
+                for key, (size, mtime_ns) in self.done.items():
+                    file.write(json.dumps({
+                        'op': 'done', 'key': key, 'size': size,
+                        'mtime_ns': mtime_ns,
+                    }, ensure_ascii=False) + '\n')
+            os.replace(temp_path, self.path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    # A completed run leaves nothing to resume, the journal is removed;
+    # otherwise it is compacted to the books done so far.
+    def close(self, completed=False):
+        self.file.close()
+        if not completed:
+            self.compact()
+            return
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
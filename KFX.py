@@ -0,0 +1,257 @@
+import struct
+
+import KindleUnpack
+
+
+ION_SIGNATURE = b'\xe0\x01\x00\xea'
+
+# Symbol ids of the system and YJ_symbols shared tables used below.
+ION_IMPORTS = 6
+ION_SYMBOLS = 7
+ION_MAX_ID = 8
+SYSTEM_MAX_ID = 9
+
+CONTAINER_COMPRESSION = 410
+CONTAINER_DRM_SCHEME = 411
+INDEX_TABLE_OFFSET = 413
+INDEX_TABLE_LENGTH = 414
+DOC_SYMBOL_OFFSET = 415
+DOC_SYMBOL_LENGTH = 416
+
+EXTERNAL_RESOURCE = 164
+RESOURCE_LOCATION = 165
+METADATA = 258
+RAW_MEDIA = 417
+BOOK_METADATA = 490
+CATEGORISED_METADATA = 491
+METADATA_KEY = 492
+METADATA_VALUE = 307
+
+# Keys of the older metadata fragment, named as in book_metadata.
+METADATA_NAMES = {
+    224: 'ASIN',
+    251: 'cde_content_type',
+    424: 'cover_image',
+}
+
+
+class IonSymbol(int):
+    pass
+
+
+def read_varuint(data, pos):
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7f)
+        if byte & 0x80:
+            return value, pos
+
+
+def read_uint(data):
+    return int.from_bytes(data, 'big')
+
+
+# A minimal Ion binary reader: structs become dicts keyed by field symbol
+# id, symbols become IonSymbol, annotations are dropped, and the scalar
+# types nothing here looks at (decimals, timestamps, clobs) become None.
+def read_value(data, pos):
+    descriptor = data[pos]
+    pos += 1
+    kind, length = descriptor >> 4, descriptor & 0x0f
+
+    if kind == 14 and length == 0:
+        # A version marker between values, skip it.
+        return read_value(data, pos + 3)
+    if length == 15:
+        return None, pos
+    if kind == 1:
+        return bool(length), pos
+    if length == 14 or (kind == 13 and length == 1):
+        length, pos = read_varuint(data, pos)
+    end = pos + length
+    body = data[pos:end]
+
+    if kind == 0:
+        return None, end
+    elif kind == 2:
+        return read_uint(body), end
+    elif kind == 3:
+        return -read_uint(body), end
+    elif kind == 4:
+        return struct.unpack('>d' if length == 8 else '>f', body)[0] \
+            if length > 0 else 0.0, end
+    elif kind == 7:
+        return IonSymbol(read_uint(body)), end
+    elif kind == 8:
+        return bytes(body).decode('utf-8'), end
+    elif kind == 10:
+        return bytes(body), end
+    elif kind in (11, 12):
+        values = []
+        while pos < end:
+            value, pos = read_value(data, pos)
+            values.append(value)
+        return values, end
+    elif kind == 13:
+        fields = dict()
+        while pos < end:
+            field, pos = read_varuint(data, pos)
+            if data[pos] >> 4 == 0 and data[pos] & 0x0f != 15:
+                # Padding inside a struct.
+                pos = read_value(data, pos)[1]
+                continue
+            fields[field], pos = read_value(data, pos)
+        return fields, end
+    elif kind == 14:
+        annotations, pos = read_varuint(data, pos)
+        return read_value(data, pos + annotations)[0], end
+    return None, end
+
+
+def loads(data):
+    data = bytes(data)
+    pos = len(ION_SIGNATURE) if data.startswith(ION_SIGNATURE) else 0
+    return read_value(data, pos)[0]
+
+
+# Only the container header, the entity index and the document symbols are
+# read up front; every other entity is read on demand from its offset.
+class KFXContainer:
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        try:
+            header = self.file.read(18)
+            if len(header) < 18 or header[:4] != b'CONT':
+                raise OSError('The specified file is not a KFX container!')
+            _version, self.header_len, info_offset, info_length = \
+                struct.unpack_from('<HLLL', header, 4)
+            info = loads(self.read(info_offset, info_length))
+            if not isinstance(info, dict):
+                raise OSError('The KFX container info is damaged!')
+            if info.get(CONTAINER_COMPRESSION, 0) != 0 \
+                    or info.get(CONTAINER_DRM_SCHEME, 0) != 0:
+                raise OSError('The KFX container is compressed or protected!')
+            self.entities = self.read_index(
+                info.get(INDEX_TABLE_OFFSET), info.get(INDEX_TABLE_LENGTH)
+            )
+            self.symbol_base, self.symbols = self.read_symbols(
+                info.get(DOC_SYMBOL_OFFSET), info.get(DOC_SYMBOL_LENGTH)
+            )
+            self.symbol_ids = None
+        except Exception:
+            self.file.close()
+            raise
+
+    def read(self, offset, length):
+        KindleUnpack.count_read(length)
+        self.file.seek(offset)
+        data = self.file.read(length)
+        if len(data) < length:
+            raise OSError('The KFX container is truncated!')
+        return data
+
+    # Entity type -> [(entity id, offset, length)].
+    def read_index(self, offset, length):
+        if offset is None or not length:
+            raise OSError('The KFX container has no entity index!')
+        index = self.read(offset, length)
+        entities = dict()
+        for pos in range(0, len(index) - 23, 24):
+            entity_id, entity_type, entity_offset, entity_length = \
+                struct.unpack_from('<LLQQ', index, pos)
+            entities.setdefault(entity_type, []).append(
+                (entity_id, self.header_len + entity_offset, entity_length)
+            )
+        return entities
+
+    def read_symbols(self, offset, length):
+        base = SYSTEM_MAX_ID + 1
+        if offset is None or not length:
+            return (base, [])
+        table = loads(self.read(offset, length))
+        if not isinstance(table, dict):
+            return (base, [])
+        for shared in table.get(ION_IMPORTS) or []:
+            base += shared.get(ION_MAX_ID, 0)
+        return (base, table.get(ION_SYMBOLS) or [])
+
+    def get_symbol(self, symbol_id):
+        if symbol_id >= self.symbol_base \
+                and symbol_id - self.symbol_base < len(self.symbols):
+            return self.symbols[symbol_id - self.symbol_base]
+        return '$%d' % symbol_id
+
+    def get_symbol_id(self, name):
+        if self.symbol_ids is None:
+            self.symbol_ids = dict(
+                (symbol, self.symbol_base + index)
+                for index, symbol in enumerate(self.symbols)
+            )
+        return self.symbol_ids.get(name)
+
+    def get_text(self, value):
+        if isinstance(value, IonSymbol):
+            return self.get_symbol(value)
+        return value if isinstance(value, str) else None
+
+    # (offset, length) of the payload of an entity, past its ENTY header.
+    def get_payload_location(self, offset, length):
+        header = self.read(offset, 10)
+        if header[:4] != b'ENTY':
+            raise OSError('The KFX entity is damaged!')
+        header_len, = struct.unpack_from('<L', header, 6)
+        return (offset + header_len, length - header_len)
+
+    def get_entities(self, entity_type):
+        return self.entities.get(entity_type, [])
+
+    def find_entity(self, entity_type, name):
+        entity_id = self.get_symbol_id(name)
+        for entity in self.get_entities(entity_type):
+            if entity[0] == entity_id:
+                return entity
+        return None
+
+    def load_entity(self, entity):
+        return loads(self.read(*self.get_payload_location(*entity[1:])))
+
+    def get_metadata(self):
+        metadata = dict()
+        for entity in self.get_entities(BOOK_METADATA):
+            value = self.load_entity(entity)
+            for category in value.get(CATEGORISED_METADATA) or []:
+                for entry in category.get(METADATA) or []:
+                    key = self.get_text(entry.get(METADATA_KEY))
+                    metadata.setdefault(
+                        key, self.get_text(entry.get(METADATA_VALUE))
+                    )
+        for entity in self.get_entities(METADATA):
+            value = self.load_entity(entity)
+            for field, key in METADATA_NAMES.items():
+                if field in value:
+                    metadata.setdefault(key, self.get_text(value[field]))
+        return metadata
+
+    # The cover resource names its raw media entity by location.
+    def get_resource_location(self, name):
+        resource = self.find_entity(EXTERNAL_RESOURCE, name)
+        if resource is None:
+            return None
+        location = self.get_text(
+            self.load_entity(resource).get(RESOURCE_LOCATION)
+        )
+        media = self.find_entity(RAW_MEDIA, location)
+        if media is None:
+            return None
+        return self.get_payload_location(*media[1:])
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -19,25 +19,63 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import struct
+import threading
 
+# Sections and bytes served on the current thread, for instrumentation.
+io_counters = threading.local()
 
+
+def count_read(length):
+    io_counters.sections = getattr(io_counters, 'sections', 0) + 1
+    io_counters.bytes = getattr(io_counters, 'bytes', 0) + length
+
+
+# Only the palm header and the section table are read up front, sections are
+# served from a read-only memory map as zero-copy memoryviews (or with
+# positioned reads when the file can not be mapped).
 class Sectionizer:
+    idents = (b'BOOKMOBI', b'TEXtREAd')
+
     def __init__(self, filename):
-        self.data = open(filename, 'rb').read()
-        self.palmheader = self.data[:78]
-        self.palmname = self.data[:32]
-        self.ident = self.palmheader[0x3C:0x3C+8]
-        self.num_sections, = struct.unpack_from('>H', self.palmheader, 76)
-        self.filelength = len(self.data)
-        sectionsdata = struct.unpack_from('>%dL' % (self.num_sections*2), self.data, 78) + (self.filelength, 0)
-        self.sectionoffsets = sectionsdata[::2]
-        self.sectionattributes = sectionsdata[1::2]
+        self.file = open(filename, 'rb')
+        try:
+            self.palmheader = self.file.read(78)
+            if len(self.palmheader) < 78:
+                raise OSError('The specified file is not E-Book!')
+            self.palmname = self.palmheader[:32]
+            self.ident = self.palmheader[0x3C:0x3C+8]
+            if self.ident not in Sectionizer.idents:
+                raise OSError('The specified file is not E-Book!')
+            self.num_sections, = struct.unpack_from('>H', self.palmheader, 76)
+            self.filelength = os.fstat(self.file.fileno()).st_size
+            table = self.file.read(self.num_sections * 8)
+            if len(table) < self.num_sections * 8:
+                raise OSError('The section table is truncated!')
+            sectionsdata = struct.unpack_from(
+                '>%dL' % (self.num_sections*2), table, 0
+            ) + (self.filelength, 0)
+            self.sectionoffsets = sectionsdata[::2]
+            self.sectionattributes = sectionsdata[1::2]
+            self.data = self.map_file()
+        except Exception:
+            self.file.close()
+            raise
         # noinspection PyUnusedLocal
         self.sectiondescriptions = ["" for x in range(self.num_sections+1)]
         self.sectiondescriptions[-1] = "File Length Only"
         return
 
+    def map_file(self):
+        import mmap
+        try:
+            return memoryview(mmap.mmap(
+                self.file.fileno(), 0, access=mmap.ACCESS_READ
+            ))
+        except (OSError, ValueError):
+            return None
+
     def setsectiondescription(self, section, description):
         if section < len(self.sectiondescriptions):
             self.sectiondescriptions[section] = description
@@ -46,7 +84,32 @@ class Sectionizer:
 
     def load_section(self, section):
         before, after = self.sectionoffsets[section:section+2]
-        return self.data[before:after]
+        return self.read(before, after - before)
+
+    def read(self, offset, length):
+        count_read(length)
+        if self.data is not None:
+            return self.data[offset:offset+length]
+        self.file.seek(offset)
+        return memoryview(self.file.read(length))
+
+    def close(self):
+        if self.data is not None:
+            mapped = self.data.obj
+            self.data.release()
+            self.data = None
+            try:
+                mapped.close()
+            except BufferError:
+                # Sections handed out are still alive, let them own the map.
+                pass
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
 
 class MobiHeader:
@@ -131,11 +194,18 @@ class MobiHeader:
         406: 'Rental_Indicator',
     }
 
+    id_map_names = dict(
+        (name, tmpid)
+        for id_map in (id_map_strings, id_map_values, id_map_hexstrings)
+        for tmpid, name in id_map.items()
+    )
+
     def __init__(self, sect, sectnumber):
         self.metadata = {}
+        self.exth_index = None
         self.sect = sect
         self.start = sectnumber
-        self.header = self.sect.load_section(self.start)
+        self.header = bytes(self.sect.load_section(self.start))
         if len(self.header) > 20 and self.header[16:20] == b'MOBI':
             self.sect.setsectiondescription(0, b"Mobipocket Header")
             self.palm = False
@@ -169,7 +239,7 @@ class MobiHeader:
         self.dividx = 0xffffffff
         self.othidx = 0xffffffff
         self.fdst = 0xffffffff
-        self.mlstart = self.sect.load_section(self.start+1)[:4]
+        self.mlstart = bytes(self.sect.load_section(self.start+1)[:4])
 
         if self.palm:
             return
@@ -265,41 +335,64 @@ class MobiHeader:
                 self.fdst += self.start
                 # setting of fdst section description properly handled in mobi_kf8proc
 
+    # Maps every EXTH record id to the (offset, size) of its contents in
+    # self.exth, in a single pass and without copying any record.
+    def getexthindex(self):
+        if self.exth_index is not None:
+            return self.exth_index
+        self.exth_index = {}
+        if not self.hasexth:
+            return self.exth_index
+        _length, num_items = struct.unpack_from('>LL', self.exth, 4)
+        pos = 12
+        for _ in range(num_items):
+            tmpid, size = struct.unpack_from('>LL', self.exth, pos)
+            if size < 8:
+                break
+            self.exth_index.setdefault(tmpid, []).append((pos + 8, size - 8))
+            pos += size
+        return self.exth_index
+
+    def getexthname(self, tmpid):
+        for id_map in (MobiHeader.id_map_strings, MobiHeader.id_map_values,
+                       MobiHeader.id_map_hexstrings):
+            if tmpid in id_map:
+                return id_map[tmpid]
+        return str(tmpid) + ' (hex)'
+
+    def getexthid(self, name):
+        tmpid = MobiHeader.id_map_names.get(name)
+        if tmpid is None and name.endswith(' (hex)'):
+            try:
+                tmpid = int(name[:-6])
+            except ValueError:
+                pass
+        return tmpid
+
+    def decodeexth(self, tmpid, offset, size):
+        content = self.exth[offset:offset + size]
+        if tmpid in MobiHeader.id_map_values and size in (1, 2, 4):
+            value, = struct.unpack({1: 'B', 2: '>H', 4: '>L'}[size], content)
+            return str(value)
+        return content
+
+    # The values of a single metadata name, decoded on demand.
+    def getmetadatavalue(self, name):
+        if self.metadata:
+            return self.metadata.get(name)
+        tmpid = self.getexthid(name)
+        entries = self.getexthindex().get(tmpid)
+        if entries is None:
+            return None
+        return [self.decodeexth(tmpid, offset, size)
+                for offset, size in entries]
+
     def getmetadata(self):
-        def addvalue(tmpname, tmpvalue):
-            if tmpname not in self.metadata:
-                self.metadata[tmpname] = [tmpvalue]
-            else:
-                self.metadata[tmpname].append(tmpvalue)
-        if self.hasexth:
-            extheader = self.exth
-            _length, num_items = struct.unpack('>LL', extheader[4:12])
-            extheader = extheader[12:]
-            pos = 0
-            for _ in range(num_items):
-                tmpid, size = struct.unpack('>LL', extheader[pos:pos+8])
-                content = extheader[pos + 8: pos + size]
-                if tmpid in MobiHeader.id_map_strings.keys():
-                    name = MobiHeader.id_map_strings[tmpid]
-                    addvalue(name, content)
-                elif tmpid in MobiHeader.id_map_values.keys():
-                    name = MobiHeader.id_map_values[tmpid]
-                    if size == 9:
-                        value, = struct.unpack('B', content)
-                        addvalue(name, str(value))
-                    elif size == 10:
-                        value, = struct.unpack('>H', content)
-                        addvalue(name, str(value))
-                    elif size == 12:
-                        value, = struct.unpack('>L', content)
-                        addvalue(name, str(value))
-                    else:
-                        addvalue(name, content)
-                elif tmpid in MobiHeader.id_map_hexstrings.keys():
-                    name = MobiHeader.id_map_hexstrings[tmpid]
-                    addvalue(name, content)
-                else:
-                    name = str(tmpid) + ' (hex)'
-                    addvalue(name, content)
-                pos += size
-        return self.metadata
\ No newline at end of file
+        if self.metadata:
+            return self.metadata
+        for tmpid, entries in self.getexthindex().items():
+            self.metadata[self.getexthname(tmpid)] = [
+                self.decodeexth(tmpid, offset, size)
+                for offset, size in entries
+            ]
+        return self.metadata
@@ -0,0 +1,395 @@
+import os
+import re
+import json
+from array import array
+
+import KindleUnpack
+from File import open_ebook
+from Thumbnail import PLACEHOLDER_SIZE, is_broken_image
+
+
+EBOOK_EXTENSIONS = ('.mobi', '.azw', '.azw3', '.azw4', '.kfx')
+
+GUESSED_ASIN = re.compile(r'_([\w-]*)\.(?:kfx|azw\d{0,1}|prc|[mp]obi)$')
+
+SIDECAR_ASIN = re.compile(r'_([\w-]*)\.sdr$')
+
+# How sure the cleanup is that a thumbnail is an orphan, most sure first.
+ORPHAN_CONFIDENCES = ('high', 'medium', 'low')
+
+THUMBNAIL_HEAD_SIZE = 64 * 1024
+THUMBNAIL_TAIL_SIZE = 1024
+
+INDEX_KINDS = ('book', 'thumbnail')
+
+# The thumbnail of a book is ok, damaged or missing; a thumbnail is ok,
+# damaged or a high confidence orphan.
+INDEX_STATUSES = (None, 'ok', 'damaged', 'missing', 'orphan')
+
+INDEX_FIELDS = (
+    'id', 'kind', 'path', 'size', 'mtime_ns', 'asin', 'cdetype',
+    'cover_offset', 'cover_length', 'status',
+)
+
+THUMBNAIL_NAME = re.compile(
+    r'^thumbnail_(.+?)(?:_([^_]+?))?(?:_(portrait|landscape))?\.\w+$'
+)
+
+
+class Ebook:
+    __slots__ = ('path', 'stat')
+
+    def __init__(self, path, stat):
+        self.path = path
+        self.stat = stat
+
+
+class Thumbnail:
+    __slots__ = ('path', 'asin', 'cdetype', 'orientation', 'stat')
+
+    def __init__(self, path, asin, cdetype, orientation, stat):
+        self.path = path
+        self.asin = asin
+        self.cdetype = cdetype
+        self.orientation = orientation
+        self.stat = stat
+
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+
+
+def is_ebook_name(name):
+    return name.lower().endswith(EBOOK_EXTENSIONS)
+
+
+def parse_thumbnail_name(name):
+    match = THUMBNAIL_NAME.match(name)
+    return match.groups() if match is not None else None
+
+
+def guess_asin(name):
+    match = GUESSED_ASIN.search(name)
+    return match.group(1) if match is not None else None
+
+
+def guess_sidecar_asin(name):
+    match = SIDECAR_ASIN.search(name)
+    return match.group(1) if match is not None else None
+
+
+# Return the thumbnails no ebook claims with how sure it is they are
+# orphans, in one pass over the thumbnails. books is the set of the (ASIN,
+# cdetype) read from the ebooks, names the ASINs found in the file and
+# sidecar names. A thumbnail nothing refers to is a high confidence orphan,
+# one whose ASIN an ebook has under another cdetype (e.g. a PDOC thumbnail
+# left by a convert) a medium one, and one only a name refers to a low one.
+# While an ebook has no ASIN, the thumbnails of its cdetype may be its own
+# and are low confidence orphans too. An ebook that could not be read has
+# no cdetype either, it can only claim the ASIN guessed from its name.
+def find_orphan_thumbnails(thumbnails, books, names):
+    asins = set(asin for asin, _ in books)
+    unknown = set(cdetype for asin, cdetype in books if asin is None)
+    unknown.discard(None)
+    orphans = []
+    for asin, entries in thumbnails.items():
+        for thumbnail in entries:
+            if (asin, thumbnail.cdetype) in books \
+                    or (thumbnail.cdetype is None and asin in asins):
+                continue
+            if asin in asins:
+                confidence = 'medium'
+            elif asin in names or thumbnail.cdetype in unknown:
+                confidence = 'low'
+            else:
+                confidence = 'high'
+            orphans.append((thumbnail, confidence))
+    return orphans
+
+
+# Walk a directory tree once with os.scandir. Sidecar directories (.sdr) are
+# reported through on_sidecar and not descended into.
+def walk_files(path, on_sidecar=None):
+    directories = [path]
+    while len(directories) > 0:
+        try:
+            entries = os.scandir(directories.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name.endswith('.sdr'):
+                            if on_sidecar is not None:
+                                on_sidecar(entry)
+                        else:
+                            directories.append(entry.path)
+                    elif entry.is_file():
+                        yield entry
+                except OSError:
+                    continue
+
+
+# Return the ebooks under the documents directory, the ASINs guessed from the
+# file names and the sidecar directories, all in a single pass.
+def scan_documents(path):
+    ebooks = []
+    guessed_asins = set()
+    sidecars = []
+    for entry in walk_files(path, sidecars.append):
+        asin = guess_asin(entry.name)
+        if asin is not None:
+            guessed_asins.add(asin)
+        if is_ebook_name(entry.name):
+            try:
+                ebooks.append(Ebook(entry.path, entry.stat()))
+            except OSError:
+                continue
+    return (ebooks, guessed_asins, [entry.path for entry in sidecars])
+
+
+# Return the thumbnails indexed by ASIN, an ASIN can have several thumbnails
+# (e.g. different orientations or cdetypes).
+def scan_thumbnails(path):
+    thumbnails = dict()
+    for entry in walk_files(path):
+        name = parse_thumbnail_name(entry.name)
+        if name is None:
+            continue
+        try:
+            thumbnail = Thumbnail(entry.path, *name, entry.stat())
+        except OSError:
+            continue
+        thumbnails.setdefault(thumbnail.asin, []).append(thumbnail)
+    return thumbnails
+
+
+# Read the ASIN, cdetype and the locations of the cover and the thumbnail
+# from the headers of an ebook.
+def read_ebook_header(path):
+    with open_ebook(path) as mobi_file:
+        return (
+            mobi_file.get_metadata('ASIN'),
+            mobi_file.get_metadata('Document Type'),
+            mobi_file.get_cover_location(),
+            mobi_file.get_thumb_location(),
+        )
+
+
+# Only the head and the tail of a thumbnail are read, its size comes from
+# the directory scan when known. A whole image under PLACEHOLDER_SIZE is
+# the grey placeholder of a dropped cover and is damaged too, a missing
+# thumbnail is not.
+def is_damaged_thumbnail(path, size=None):
+    try:
+        with open(path, 'rb') as file:
+            if size is None:
+                size = os.fstat(file.fileno()).st_size
+            if size < PLACEHOLDER_SIZE:
+                return True
+            head = file.read(THUMBNAIL_HEAD_SIZE)
+            KindleUnpack.count_read(len(head))
+            if size <= THUMBNAIL_HEAD_SIZE:
+                return is_broken_image(head, head)
+            file.seek(max(size - THUMBNAIL_TAIL_SIZE, THUMBNAIL_HEAD_SIZE))
+            tail = file.read(THUMBNAIL_TAIL_SIZE)
+            KindleUnpack.count_read(len(tail))
+            return is_broken_image(head, tail, True)
+    except OSError:
+        return False
+
+
+def check_thumbnails(thumbnails):
+    return [is_damaged_thumbnail(path, size) for path, size in thumbnails]
+
+
+class LibraryEntry:
+    __slots__ = INDEX_FIELDS
+
+    def __init__(self, *values):
+        for name, value in zip(INDEX_FIELDS, values):
+            setattr(self, name, value)
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in INDEX_FIELDS)
+
+
+# The books and thumbnails of a Kindle root in typed arrays, one column per
+# field. ASINs and cdetypes are stored once and referred to by id, paths
+# are relative to the root. Entries are built on access, and the lookup
+# tables on the first lookup.
+class LibraryIndex:
+    def __init__(self, root):
+        self.root = root
+        self.paths = []
+        self.strings = []
+        self.string_ids = dict()
+        self.kinds = array('b')
+        self.sizes = array('q')
+        self.mtimes = array('q')
+        self.asins = array('i')
+        self.cdetypes = array('i')
+        self.cover_offsets = array('q')
+        self.cover_lengths = array('q')
+        self.statuses = array('b')
+        self.asin_index = None
+        self.path_index = None
+
+    def get_key(self, path):
+        if os.path.isabs(path):
+            path = os.path.relpath(path, self.root)
+        return path.replace(os.sep, '/')
+
+    def get_string_id(self, value):
+        if value is None:
+            return -1
+        string_id = self.string_ids.get(value)
+        if string_id is None:
+            string_id = self.string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        return string_id
+
+    def get_string(self, string_id):
+        return self.strings[string_id] if string_id >= 0 else None
+
+    def add(self, kind, path, stat, asin=None, cdetype=None, cover=None,
+            status=None):
+        self.paths.append(self.get_key(path))
+        self.kinds.append(INDEX_KINDS.index(kind))
+        self.sizes.append(stat.st_size)
+        self.mtimes.append(stat.st_mtime_ns)
+        self.asins.append(self.get_string_id(asin))
+        self.cdetypes.append(self.get_string_id(cdetype))
+        self.cover_offsets.append(cover[0] if cover is not None else -1)
+        self.cover_lengths.append(cover[1] if cover is not None else -1)
+        self.statuses.append(INDEX_STATUSES.index(status))
+        self.asin_index = self.path_index = None
+        return len(self.paths) - 1
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, entry_id):
+        if not 0 <= entry_id < len(self.paths):
+            raise IndexError(entry_id)
+        return LibraryEntry(
+            entry_id,
+            INDEX_KINDS[self.kinds[entry_id]],
+            self.paths[entry_id],
+            self.sizes[entry_id],
+            self.mtimes[entry_id],
+            self.get_string(self.asins[entry_id]),
+            self.get_string(self.cdetypes[entry_id]),
+            self.cover_offsets[entry_id]
+            if self.cover_offsets[entry_id] >= 0 else None,
+            self.cover_lengths[entry_id]
+            if self.cover_lengths[entry_id] >= 0 else None,
+            INDEX_STATUSES[self.statuses[entry_id]],
+        )
+
+    def __iter__(self):
+        for entry_id in range(len(self.paths)):
+            yield self[entry_id]
+
+    def get_entries(self, kind):
+        kind = INDEX_KINDS.index(kind)
+        for entry_id in range(len(self.paths)):
+            if self.kinds[entry_id] == kind:
+                yield self[entry_id]
+
+    def books(self):
+        return self.get_entries('book')
+
+    def thumbnails(self):
+        return self.get_entries('thumbnail')
+
+    # The books and thumbnails of an ASIN.
+    def find_asin(self, asin):
+        if self.asin_index is None:
+            self.asin_index = dict()
+            for entry_id, string_id in enumerate(self.asins):
+                if string_id >= 0:
+                    self.asin_index.setdefault(string_id, []).append(entry_id)
+        string_id = self.string_ids.get(asin)
+        return [
+            self[entry_id]
+            for entry_id in self.asin_index.get(string_id, [])
+        ]
+
+    # The entry of a path, absolute or relative to the root.
+    def find_path(self, path):
+        if self.path_index is None:
+            self.path_index = dict(
+                (key, entry_id) for entry_id, key in enumerate(self.paths)
+            )
+        entry_id = self.path_index.get(self.get_key(path))
+        return self[entry_id] if entry_id is not None else None
+
+    def to_json(self, file):
+        json.dump(
+            [entry.to_dict() for entry in self], file, ensure_ascii=False
+        )
+
+    def to_csv(self, file):
+        import csv
+        writer = csv.writer(file)
+        writer.writerow(INDEX_FIELDS)
+        for entry in self:
+            writer.writerow([getattr(entry, name) for name in INDEX_FIELDS])
+
+
+# Index the books and thumbnails of a Kindle root in a single scan of each
+# directory. Without headers the books are only listed, which reads no
+# ebook and leaves their ASIN, cdetype, cover and status unknown.
+def scan_library(root, headers=True):
+    index = LibraryIndex(root)
+    ebooks, guessed_asins, sidecars = scan_documents(
+        os.path.join(root, 'documents')
+    )
+    thumbnails = scan_thumbnails(os.path.join(root, 'system', 'thumbnails'))
+    damaged = dict(
+        (thumbnail.path, is_damaged_thumbnail(
+            thumbnail.path, thumbnail.stat.st_size
+        ))
+        for entries in thumbnails.values() for thumbnail in entries
+    )
+
+    books = set()
+    for ebook in ebooks:
+        asin = cdetype = cover = status = None
+        if headers:
+            try:
+                asin, cdetype, cover, _ = read_ebook_header(ebook.path)
+            except Exception:
+                pass
+            books.add((asin, cdetype))
+        if asin is not None and cdetype is not None:
+            paths = [
+                thumbnail.path for thumbnail in thumbnails.get(asin, [])
+                if thumbnail.cdetype == cdetype
+            ]
+            status = 'missing' if len(paths) < 1 else 'damaged' \
+                if any(damaged[path] for path in paths) else 'ok'
+        index.add('book', ebook.path, ebook.stat, asin, cdetype, cover, status)
+
+    orphans = set()
+    if headers:
+        names = set(guessed_asins)
+        names.update(
+            guess_sidecar_asin(os.path.basename(path)) for path in sidecars
+        )
+        orphans = set(
+            thumbnail.path for thumbnail, confidence
+            in find_orphan_thumbnails(thumbnails, books, names)
+            if confidence == 'high'
+        )
+    for entries in thumbnails.values():
+        for thumbnail in entries:
+            status = 'orphan' if thumbnail.path in orphans else 'damaged' \
+                if damaged[thumbnail.path] else 'ok'
+            index.add(
+                'thumbnail', thumbnail.path, thumbnail.stat, thumbnail.asin,
+                thumbnail.cdetype, status=status
+            )
+    return index
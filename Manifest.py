@@ -0,0 +1,90 @@
+import os
+import json
+
+
+# A record of the books seen on a Kindle, keyed by their path relative to the
+# Kindle root. A book whose size and mtime did not change since the last run
+# does not need to be parsed again, and a book whose thumbnail did not change
+# either does not need to be touched at all.
+class Manifest:
+    version = 1
+    filename = '.fix_kindle_ebook_cover.json'
+
+    def __init__(self, root):
+        self.root = root
+        self.path = os.path.join(root, self.filename)
+        self.books = self.load()
+        self.seen = set()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+            if data.get('version') == self.version:
+                return data['books']
+        except Exception:
+            pass
+        return dict()
+
+    def get_key(self, path):
+        return os.path.relpath(path, self.root).replace(os.sep, '/')
+
+    def get_book(self, path, stat):
+        key = self.get_key(path)
+        self.seen.add(key)
+        book = self.books.get(key)
+        if book is None or book['size'] != stat.st_size \
+                or book['mtime_ns'] != stat.st_mtime_ns:
+            return None
+        return book
+
+    def set_book(self, path, stat, asin, cdetype, cover, thumbnail=None,
+                 thumb=None):
+        key = self.get_key(path)
+        self.seen.add(key)
+        self.books[key] = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'asin': asin,
+            'cdetype': cdetype,
+            'cover': list(cover) if cover is not None else None,
+            'thumb': list(thumb) if thumb is not None else None,
+            'thumbnail': self.get_thumbnail_state(thumbnail),
+        }
+
+    def get_thumbnail_state(self, path):
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return [self.get_key(path), stat.st_size, stat.st_mtime_ns]
+
+    def is_thumbnail_intact(self, book):
+        if book['thumbnail'] is None:
+            return True
+        name, size, mtime_ns = book['thumbnail']
+        try:
+            stat = os.stat(os.path.join(self.root, name))
+        except OSError:
+            return False
+        return stat.st_size == size and stat.st_mtime_ns == mtime_ns
+
+    # Books not seen during the run are dropped, unless the run was partial.
+    def save(self, prune=True):
+        books = dict(
+            (key, book) for key, book in self.books.items()
+            if key in self.seen or not prune
+        )
+        # Write aside and rename, a partial write never replaces a good one.
+        temp_path = '%s.tmp' % self.path
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump({'version': self.version, 'books': books}, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
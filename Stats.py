@@ -0,0 +1,137 @@
+import time
+from contextlib import contextmanager
+
+
+# Wall time per phase, counters and per-book latency histograms of a run,
+# with optional cProfile and tracemalloc capture.
+class Stats:
+    buckets = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self, profile=False):
+        self.phases = dict()
+        self.counters = dict()
+        self.latencies = dict()
+        self.profile = profile
+        self.profiler = None
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0) + seconds
+
+    # Account the time spent waiting for the next item to a phase.
+    def timed(self, iterable, name):
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(name, time.perf_counter() - start)
+                return
+            self.add_time(name, time.perf_counter() - start)
+            yield item
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_latency(self, name, seconds):
+        self.latencies.setdefault(name, []).append(seconds)
+
+    def get_histogram(self, latencies):
+        histogram = dict()
+        for latency in latencies:
+            milliseconds = latency * 1000
+            for bucket in self.buckets:
+                if milliseconds < bucket:
+                    key = '<%dms' % bucket
+                    break
+            else:
+                key = '>=%dms' % self.buckets[-1]
+            histogram[key] = histogram.get(key, 0) + 1
+        return histogram
+
+    def get_percentile(self, latencies, percent):
+        index = min(int(len(latencies) * percent / 100), len(latencies) - 1)
+        return latencies[index]
+
+    # Add the phases, counters and latencies of another run.
+    def merge(self, other):
+        for name, seconds in other.phases.items():
+            self.add_time(name, seconds)
+        for name, value in other.counters.items():
+            self.count(name, value)
+        for name, values in other.latencies.items():
+            self.latencies.setdefault(name, []).extend(values)
+
+    def start_profile(self):
+        if not self.profile:
+            return
+        import cProfile
+        import tracemalloc
+        tracemalloc.start()
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def stop_profile(self):
+        if self.profiler is None:
+            return None
+        import pstats
+        import tracemalloc
+        self.profiler.disable()
+        current, peak = tracemalloc.get_traced_memory()
+        allocations = tracemalloc.take_snapshot().statistics('lineno')[:10]
+        tracemalloc.stop()
+
+        functions = []
+        profile = pstats.Stats(self.profiler)
+        profile.sort_stats('cumulative')
+        for function in profile.fcn_list[:25]:
+            calls, primitive, total, cumulative, callers = \
+                profile.stats[function]
+            functions.append({
+                'function': '%s:%d(%s)' % function,
+                'calls': calls,
+                'tottime': total,
+                'cumtime': cumulative,
+            })
+        self.profiler = None
+
+        return {
+            'functions': functions,
+            'memory': {
+                'current': current,
+                'peak': peak,
+                'top': [
+                    {'line': str(stat.traceback), 'size': stat.size}
+                    for stat in allocations
+                ],
+            },
+        }
+
+    def report(self, profile=None):
+        latencies = dict()
+        for name, values in self.latencies.items():
+            values = sorted(values)
+            latencies[name] = {
+                'count': len(values),
+                'p50': self.get_percentile(values, 50),
+                'p90': self.get_percentile(values, 90),
+                'p99': self.get_percentile(values, 99),
+                'max': values[-1],
+                'histogram': self.get_histogram(values),
+            }
+        report = {
+            'phases': self.phases,
+            'counters': self.counters,
+            'latencies': latencies,
+        }
+        if profile is not None:
+            report['profile'] = profile
+        return report
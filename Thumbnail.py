@@ -0,0 +1,175 @@
+import re
+import struct
+from io import BytesIO
+
+
+# Target thumbnail sizes (width, height) of the Kindle home screen.
+MODEL_SIZES = {
+    'kindle': (220, 330),
+    'paperwhite': (330, 470),
+    'oasis': (355, 510),
+    'scribe': (500, 720),
+}
+
+# Below this size a thumbnail is the placeholder a Kindle leaves after it
+# drops the cover of a sideloaded ebook.
+PLACEHOLDER_SIZE = 2000
+
+# Thumbnails larger than this on a side are damaged headers.
+MAX_DIMENSION = 10000
+
+IMAGE_TRAILERS = {
+    'jpeg': b'\xff\xd9',
+    'png': b'IEND\xaeB`\x82',
+    'gif': b';',
+}
+
+JPEG_SOF_MARKERS = (
+    0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+    0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF,
+)
+
+
+def get_thumbnail_size(value):
+    if value is None or isinstance(value, tuple):
+        return value
+    if value.lower() in MODEL_SIZES:
+        return MODEL_SIZES[value.lower()]
+    size = re.match(r'^(\d+)x(\d+)$', value)
+    if size is None:
+        raise ValueError('Unknown thumbnail size: %s' % value)
+    return (int(size.group(1)), int(size.group(2)))
+
+
+# The image type from its magic bytes, for the cover resources of an ebook
+# as well as thumbnails.
+def get_image_type(data):
+    if data[:3] == b'\xff\xd8\xff':
+        return 'jpeg'
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'png'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    return None
+
+
+# Walk the JPEG segments up to the first SOF marker. Returns the frame
+# (marker, width, height) or None, and whether the data ran out before the
+# frame was found.
+def walk_jpeg_segments(data):
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            return (None, False)
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+        length, = struct.unpack_from('>H', data, offset + 2)
+        if marker in JPEG_SOF_MARKERS:
+            if offset + 9 > len(data):
+                return (None, True)
+            height, width = struct.unpack_from('>HH', data, offset + 5)
+            return ((marker, width, height), False)
+        if marker in (0xD9, 0xDA):
+            return (None, False)
+        offset += 2 + length
+    return (None, True)
+
+
+def get_jpeg_frame(data):
+    return walk_jpeg_segments(data)[0]
+
+
+# Read the dimensions from the image header without decoding the image.
+def get_image_size(data):
+    imgtype = get_image_type(data)
+    if imgtype == 'jpeg':
+        frame = get_jpeg_frame(data)
+        return frame[1:] if frame is not None else None
+    if imgtype == 'png' and len(data) >= 24:
+        return struct.unpack_from('>LL', data, 16)
+    if imgtype == 'gif' and len(data) >= 10:
+        return struct.unpack_from('<HH', data, 6)
+    return None
+
+
+# Tell a broken image from its first and last bytes without decoding it:
+# the header has to give plausible dimensions (for a JPEG, from a frame
+# reached before the scan data) and the file has to end with the trailer
+# of its type, past any zero padding. A truncated or zero-filled file fails
+# one or the other. When head is only the start of the file, a JPEG whose
+# segments run past it has unknown dimensions, only its trailer is checked.
+def is_broken_image(head, tail, partial=False):
+    imgtype = get_image_type(head)
+    if imgtype == 'jpeg':
+        frame, ran_out = walk_jpeg_segments(head)
+        if frame is None and not (partial and ran_out):
+            return True
+        image_size = frame[1:] if frame is not None else None
+    else:
+        image_size = get_image_size(head)
+        if image_size is None:
+            return True
+    if image_size is not None and not (
+            0 < image_size[0] <= MAX_DIMENSION
+            and 0 < image_size[1] <= MAX_DIMENSION):
+        return True
+    return not tail.rstrip(b'\x00').endswith(IMAGE_TRAILERS[imgtype])
+
+
+def is_baseline_jpeg(data):
+    frame = get_jpeg_frame(data)
+    return frame is not None and frame[0] in (0xC0, 0xC1)
+
+
+def is_large_enough(data, size):
+    image_size = get_image_size(data) if data is not None else None
+    return image_size is not None \
+        and image_size[0] >= size[0] and image_size[1] >= size[1]
+
+
+def fits_in(data, size):
+    image_size = get_image_size(data)
+    return image_size is not None \
+        and image_size[0] <= size[0] and image_size[1] <= size[1]
+
+
+def get_pillow():
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+
+def resize_image(data, size):
+    Image = get_pillow()
+    if Image is None:
+        return data
+    try:
+        image = Image.open(BytesIO(data))
+        image.draft('RGB', size)
+        image = image.convert('RGB')
+        image.thumbnail(size, Image.LANCZOS)
+        output = BytesIO()
+        image.save(output, 'JPEG', quality=85, optimize=True)
+        return output.getvalue()
+    except Exception:
+        return data
+
+
+# Produce a thumbnail no larger than size, preferring the embedded thumbnail
+# when it is large enough. Without Pillow the image is passed through. A
+# thumbnail under PLACEHOLDER_SIZE would be taken for a placeholder and
+# fixed again on the next run, the cover is written as is instead.
+def make_thumbnail(cover, thumb, size):
+    if size is None or cover is None:
+        return cover
+    image = thumb if is_large_enough(thumb, size) else cover
+    if not (is_baseline_jpeg(image) and fits_in(image, size)):
+        image = resize_image(image, size)
+    return image if len(image) >= PLACEHOLDER_SIZE else cover
@@ -0,0 +1,174 @@
+import os
+import sys
+import time
+import select
+import struct
+
+from Library import walk_files
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+# Changes are reported as a set of file paths, or None when some events
+# were lost and the directories have to be scanned again.
+class InotifyWatcher:
+    def __init__(self, paths):
+        import ctypes
+        import ctypes.util
+        self.libc = ctypes.CDLL(
+            ctypes.util.find_library('c') or 'libc.so.6', use_errno=True
+        )
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.directories = dict()
+        try:
+            for path in paths:
+                self.add_tree(path)
+        except Exception:
+            self.close()
+            raise
+
+    def add_watch(self, path):
+        import ctypes
+        descriptor = self.libc.inotify_add_watch(
+            self.fd, os.fsencode(path), WATCH_MASK
+        )
+        if descriptor < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed', path)
+        self.directories[descriptor] = path
+
+    # Watch a directory and every directory below it but sidecars, and
+    # return the files already there, which a new directory may have got
+    # before it was watched.
+    def add_tree(self, path):
+        files = set()
+        directories = [path]
+        while len(directories) > 0:
+            path = directories.pop()
+            try:
+                self.add_watch(path)
+                entries = os.scandir(path)
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not entry.name.endswith('.sdr'):
+                                directories.append(entry.path)
+                        elif entry.is_file():
+                            files.add(entry.path)
+                    except OSError:
+                        continue
+        return files
+
+    def read(self, timeout=None):
+        readable, _, _ = select.select(
+            [self.fd], [], [], timeout if timeout is not None else 1.0
+        )
+        if len(readable) < 1:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changes = set()
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            descriptor, mask, _cookie, length = \
+                EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset+length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            directory = self.directories.get(descriptor)
+            if mask & IN_IGNORED:
+                self.directories.pop(descriptor, None)
+                continue
+            if directory is None or len(name) < 1:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) \
+                        and not name.endswith('.sdr'):
+                    changes.update(self.add_tree(path))
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                changes.add(path)
+        return changes
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+# Compare the size and mtime of every file between two scans.
+class PollingWatcher:
+    def __init__(self, paths, interval=5.0):
+        self.paths = paths
+        self.interval = interval
+        self.snapshot = self.scan()
+
+    def scan(self):
+        snapshot = dict()
+        for path in self.paths:
+            for entry in walk_files(path):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                snapshot[entry.path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def read(self, timeout=None):
+        time.sleep(timeout if timeout is not None else self.interval)
+        snapshot = self.scan()
+        changes = set(
+            path for path, state in snapshot.items()
+            if self.snapshot.get(path) != state
+        )
+        self.snapshot = snapshot
+        return changes
+
+    def close(self):
+        pass
+
+
+def get_watcher(paths, interval=5.0):
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(paths)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(paths, interval)
+
+
+# Gather changes until none came for debounce seconds, so a book still
+# being copied or a burst of thumbnails is handled once.
+def wait_changes(watcher, debounce=2.0, cancelled=None):
+    changes = set()
+    while cancelled is None or not cancelled.is_set():
+        batch = watcher.read(debounce if len(changes) > 0 else None)
+        if batch is None:
+            return None
+        if len(batch) > 0:
+            changes.update(batch)
+        elif len(changes) > 0:
+            return changes
+    return changes
@@ -0,0 +1,302 @@
+import os
+import random
+import sqlite3
+import struct
+
+
+# A structurally valid JPEG (SOI, APP0, SOF0, SOS, EOI) of the given
+# dimensions, padded to roughly size bytes. It is not meant to be decoded.
+def build_jpeg(width=600, height=800, size=20000, rand=None):
+    rand = rand or random.Random(0)
+    app0 = b'\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+    sof0 = b'\xff\xc0\x00\x11\x08' + struct.pack('>HH', height, width) \
+        + b'\x03\x01\x22\x00\x02\x11\x01\x03\x11\x01'
+    sos = b'\xff\xda\x00\x0c\x03\x01\x00\x02\x11\x03\x11\x00\x3f\x00'
+    head = b'\xff\xd8' + app0 + sof0 + sos
+    padding = max(size - len(head) - 2, 0)
+    # Scan data must not contain markers, keep every byte below 0xFF.
+    scan = bytes(rand.randrange(0, 0xFF) for _ in range(min(padding, 256)))
+    scan = (scan * (padding // max(len(scan), 1) + 1))[:padding]
+    return head + scan + b'\xff\xd9'
+
+
+def build_exth(records):
+    body = b''.join(
+        struct.pack('>LL', tag, len(data) + 8) + data
+        for tag, data in records
+    )
+    length = 12 + len(body)
+    return b'EXTH' + struct.pack('>LL', length, len(records)) + body \
+        + b'\0' * ((-length) % 4)
+
+
+def build_rec0(version, text_records, first_resource, records,
+               title=b'Synthetic Book', padding=1024):
+    header = bytearray(16 + (0xE8 if version < 8 else 0x108))
+    struct.pack_into('>HHLHHH', header, 0, 1, 0, text_records * 4096,
+                     text_records, 4096, 0)
+    header[16:20] = b'MOBI'
+    struct.pack_into('>LLLLL', header, 20, len(header) - 16, 2, 65001,
+                     1, version)
+    for offset in (0x28, 0x2C, 0xC0, 0xF4, 0xF8, 0xFC, 0x104):
+        if offset + 4 <= len(header):
+            struct.pack_into('>L', header, offset, 0xffffffff)
+    struct.pack_into('>L', header, 0x50, first_resource)
+    struct.pack_into('>L', header, 0x6C, first_resource)
+    struct.pack_into('>L', header, 0x80, 0x40)
+    exth = build_exth(records)
+    struct.pack_into('>LL', header, 0x54, len(header) + len(exth), len(title))
+    # Trailing nulls leave room for DualMetaFix to add EXTH records.
+    return bytes(header) + exth + title + b'\0' * padding
+
+
+def build_pdb(sections, name=b'Synthetic_Book'):
+    header = bytearray(78)
+    header[:len(name[:31])] = name[:31]
+    header[0x3C:0x44] = b'BOOKMOBI'
+    struct.pack_into('>H', header, 76, len(sections))
+    offset = 78 + len(sections) * 8 + 2
+    table = []
+    for number, section in enumerate(sections):
+        table.append(struct.pack('>LL', offset, number * 2))
+        offset += len(section)
+    return bytes(header) + b''.join(table) + b'\0\0' + b''.join(sections)
+
+
+def get_exth_records(asin, cdetype, cover_offset, thumb_offset, exth):
+    records = [
+        (100, b'Synthetic Author'),
+        (113, asin.encode()),
+        (501, cdetype.encode()),
+        (504, asin.encode()),
+        (201, struct.pack('>L', cover_offset)),
+        (202, struct.pack('>L', thumb_offset)),
+    ]
+    return records + [
+        (tag, data if isinstance(data, bytes) else str(data).encode())
+        for tag, data in (exth or {}).items()
+    ]
+
+
+def build_images(images, cover_size, rand):
+    cover = build_jpeg(1200, 1600, cover_size, rand)
+    thumb = build_jpeg(330, 470, max(cover_size // 10, 2000), rand)
+    others = [
+        build_jpeg(400, 300, max(cover_size // 4, 1000), rand)
+        for _ in range(max(images - 2, 0))
+    ]
+    # The cover is placed last so that a scan over every resource has to
+    # walk all of them.
+    return others + [thumb, cover]
+
+
+# kind is one of mobi7, kf8 or combo, build_kfx makes KFX books.
+def build_mobi(asin, cdetype='EBOK', kind='mobi7', text_sections=10,
+               images=5, cover_size=20000, exth=None, seed=0):
+    rand = random.Random(seed)
+    text = [
+        bytes(rand.randrange(32, 127) for _ in range(64)) * 64
+        for _ in range(text_sections)
+    ]
+    resources = build_images(images, cover_size, rand)
+    cover_offset, thumb_offset = len(resources) - 1, len(resources) - 2
+    tail = [b'FLIS' + b'\0' * 32, b'FCIS' + b'\0' * 40, b'\xe9\x8e\r\n']
+    records = get_exth_records(asin, cdetype, cover_offset, thumb_offset,
+                               exth)
+
+    if kind != 'combo':
+        version = 8 if kind == 'kf8' else 6
+        rec0 = build_rec0(version, text_sections, 1 + text_sections, records)
+        return build_pdb([rec0] + text + resources + tail)
+
+    # MOBI7 part, shared resources, BOUNDARY, then the KF8 part.
+    kf8_start = 1 + text_sections + len(resources) + 1
+    rec0 = build_rec0(
+        6, text_sections, 1 + text_sections,
+        records + [(121, struct.pack('>L', kf8_start))]
+    )
+    kf8_rec0 = build_rec0(8, text_sections, 0xffffffff, records)
+    return build_pdb(
+        [rec0] + text + resources + [b'BOUNDARY', kf8_rec0] + text
+        + [b'FDST' + b'\0' * 12] + tail
+    )
+
+
+class IonSymbol(int):
+    pass
+
+
+def ion_varuint(value):
+    data = [value & 0x7f | 0x80]
+    value >>= 7
+    while value:
+        data.append(value & 0x7f)
+        value >>= 7
+    return bytes(reversed(data))
+
+
+def ion_typed(kind, body):
+    if len(body) < 14:
+        return bytes([kind << 4 | len(body)]) + body
+    return bytes([kind << 4 | 14]) + ion_varuint(len(body)) + body
+
+
+# Just the Ion binary types a KFX container needs: ints, symbols, strings,
+# blobs, lists and structs keyed by symbol id.
+def ion_value(value):
+    if isinstance(value, IonSymbol):
+        return ion_typed(7, value.to_bytes((value.bit_length() + 7) // 8,
+                                           'big'))
+    elif isinstance(value, int):
+        return ion_typed(2, value.to_bytes((value.bit_length() + 7) // 8,
+                                           'big'))
+    elif isinstance(value, str):
+        return ion_typed(8, value.encode('utf-8'))
+    elif isinstance(value, bytes):
+        return ion_typed(10, value)
+    elif isinstance(value, list):
+        return ion_typed(11, b''.join(ion_value(item) for item in value))
+    return ion_typed(13, b''.join(
+        ion_varuint(field) + ion_value(item) for field, item in value.items()
+    ))
+
+
+def ion_annotated(annotation, value):
+    annotations = ion_varuint(annotation)
+    return ion_typed(
+        14, ion_varuint(len(annotations)) + annotations + ion_value(value)
+    )
+
+
+def build_entity(payload):
+    info = b'\xe0\x01\x00\xea' + ion_value({410: 0, 411: 0})
+    return b'ENTY' + struct.pack('<HL', 1, 10 + len(info)) + info + payload
+
+
+# A monolithic, unprotected KFX container with book metadata, the cover
+# resource and its raw media, and some other images.
+def build_kfx(asin, cdetype='EBOK', images=5, cover_size=20000, seed=0):
+    rand = random.Random(seed)
+    shared_max_id = 851
+    base = 10 + shared_max_id
+    names = ['cover', 'resource/cover'] + [
+        name for number in range(max(images - 1, 0))
+        for name in ('image%d' % number, 'resource/image%d' % number)
+    ]
+    symbol = dict((name, IonSymbol(base + i)) for i, name in enumerate(names))
+
+    entities = [(348, 490, ion_value({491: [{
+        495: 'kindle_title_metadata',
+        258: [
+            {492: 'ASIN', 307: asin},
+            {492: 'cde_content_type', 307: cdetype},
+            {492: 'cover_image', 307: 'cover'},
+            {492: 'title', 307: 'Synthetic Book'},
+        ],
+    }]}))]
+    for number in range(max(images - 1, 0)):
+        name = 'image%d' % number
+        entities.append((symbol[name], 164, ion_value(
+            {175: symbol[name], 165: 'resource/%s' % name, 161: IonSymbol(285)}
+        )))
+        entities.append((symbol['resource/%s' % name], 417,
+                         build_jpeg(400, 300, max(cover_size // 4, 1000),
+                                    rand)))
+    entities.append((symbol['cover'], 164, ion_value(
+        {175: symbol['cover'], 165: 'resource/cover', 161: IonSymbol(285)}
+    )))
+    entities.append((symbol['resource/cover'], 417,
+                     build_jpeg(1200, 1600, cover_size, rand)))
+
+    body = b''
+    index = b''
+    for entity_id, entity_type, payload in entities:
+        entity = build_entity(payload if entity_type == 417 else
+                              b'\xe0\x01\x00\xea' + payload)
+        index += struct.pack('<LLQQ', entity_id, entity_type, len(body),
+                             len(entity))
+        body += entity
+
+    symbols = b'\xe0\x01\x00\xea' + ion_annotated(3, {
+        6: [{4: 'YJ_symbols', 5: 10, 8: shared_max_id}],
+        7: names,
+    })
+    index_offset = 18
+    symbols_offset = index_offset + len(index)
+    info_offset = symbols_offset + len(symbols)
+    info = b'\xe0\x01\x00\xea' + ion_annotated(270, {
+        409: 'CR!SYNTHETIC', 410: 0, 411: 0, 412: 4096,
+        413: index_offset, 414: len(index),
+        415: symbols_offset, 416: len(symbols),
+    })
+    header_len = info_offset + len(info)
+    header = b'CONT' + struct.pack('<HLLL', 2, header_len, info_offset,
+                                   len(info))
+    return header + index + symbols + info + body
+
+
+def get_asin(number):
+    return 'B%09d' % number
+
+
+# Create a fake Kindle root with books, thumbnails and optionally a cc.db.
+# A fraction of the thumbnails is damaged (a few bytes) or missing.
+def build_library(root, books=100, damaged=0.1, missing=0.1, pdoc=0.1,
+                  kinds=('mobi7', 'kf8', 'combo'), cover_size=20000,
+                  text_sections=10, images=5, db=False, seed=0):
+    rand = random.Random(seed)
+    documents = os.path.join(root, 'documents')
+    thumbnails = os.path.join(root, 'system', 'thumbnails')
+    os.makedirs(documents, exist_ok=True)
+    os.makedirs(thumbnails, exist_ok=True)
+
+    entries = []
+    for number in range(books):
+        asin = get_asin(number)
+        cdetype = 'PDOC' if rand.random() < pdoc else 'EBOK'
+        kind = kinds[number % len(kinds)]
+        extension = {'mobi7': '.mobi', 'kfx': '.kfx'}.get(kind, '.azw3')
+        folder = os.path.join(documents, 'Author %d' % (number % 50))
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, 'Book %d_%s%s' % (number, asin, extension))
+        data = build_kfx(asin, cdetype, images, cover_size, seed=number) \
+            if kind == 'kfx' else build_mobi(
+                asin, cdetype, kind, text_sections, images, cover_size,
+                seed=number
+            )
+        with open(path, 'wb') as file:
+            file.write(data)
+        os.makedirs('%s.sdr' % os.path.splitext(path)[0], exist_ok=True)
+
+        thumbnail = os.path.join(
+            thumbnails, 'thumbnail_%s_%s_portrait.jpg' % (asin, cdetype)
+        )
+        state = rand.random()
+        if state < missing:
+            thumbnail = None
+        else:
+            with open(thumbnail, 'wb') as file:
+                file.write(
+                    b'\xff\xd8\xff' if state < missing + damaged
+                    else build_jpeg(330, 470, 8000, rand)
+                )
+        entries.append((asin, path, thumbnail, cdetype))
+
+    if db:
+        build_db(os.path.join(root, 'cc.db'), entries)
+
+    return root
+
+
+def build_db(path, entries):
+    connection = sqlite3.connect(path)
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS Entries (p_uuid TEXT PRIMARY KEY, '
+        'p_location TEXT, p_thumbnail TEXT, p_cdeType TEXT)'
+    )
+    connection.executemany(
+        'INSERT OR REPLACE INTO Entries VALUES (?, ?, ?, ?)', entries
+    )
+    connection.commit()
+    connection.close()
+    return path
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Usage: python3 -m benchmark.run [--books 100 1000 10000] [--save]
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+from benchmark.generator import build_library
+
+
+CASES = ('header', 'cover', 'fix', 'clean', 'db')
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The modules the command line, KUAL and the GUI start with.
+IMPORT_MODULES = ('fix_kindle_ebook_cover', 'FixCover')
+
+
+def get_peak_rss():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes.
+    return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024
+
+
+def run_case(case, root, jobs):
+    import KindleUnpack
+    from File import open_ebook
+    from FixCover import FixCover
+    from Library import scan_documents
+
+    ebooks = [ebook.path for ebook in scan_documents(
+        os.path.join(root, 'documents'))[0]]
+    no_db = os.path.join(root, 'no.db')
+
+    start = time.perf_counter()
+    if case == 'header':
+        for path in ebooks:
+            with KindleUnpack.Sectionizer(path) as section:
+                KindleUnpack.MobiHeader(section, 0).getmetadata()
+    elif case == 'cover':
+        for path in ebooks:
+            with open_ebook(path) as ebook:
+                ebook.get_cover_image()
+    elif case in ('fix', 'clean', 'db'):
+        db = os.path.join(root, 'cc.db') if case == 'db' else no_db
+        with FixCover(db=db, jobs=jobs) as fix_cover:
+            fix_cover.handle(
+                action='clean' if case == 'clean' else 'fix', roots=[root]
+            )
+    seconds = time.perf_counter() - start
+
+    return {
+        'books': len(ebooks),
+        'seconds': seconds,
+        'books_per_second': len(ebooks) / seconds if seconds > 0 else None,
+        'rss_mb': get_peak_rss(),
+    }
+
+
+def prepare_library(workdir, books):
+    root = os.path.join(workdir, 'library-%d' % books)
+    pristine = os.path.join(root, 'pristine')
+    if not os.path.exists(pristine):
+        shutil.rmtree(root, ignore_errors=True)
+        build_library(root, books=books, db=True)
+        os.makedirs(pristine)
+        shutil.copytree(
+            os.path.join(root, 'system', 'thumbnails'),
+            os.path.join(pristine, 'thumbnails')
+        )
+        shutil.copy(os.path.join(root, 'cc.db'), pristine)
+    return root
+
+
+# Every case starts from the same damaged library.
+def restore_library(root):
+    pristine = os.path.join(root, 'pristine')
+    thumbnails = os.path.join(root, 'system', 'thumbnails')
+    shutil.rmtree(thumbnails)
+    shutil.copytree(os.path.join(pristine, 'thumbnails'), thumbnails)
+    shutil.copy(os.path.join(pristine, 'cc.db'), root)
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if not name.startswith('.fix_kindle_ebook_cover'):
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+# Each case runs in its own interpreter so that peak RSS is its own.
+def spawn_case(case, root, jobs):
+    output = subprocess.check_output([
+        sys.executable, '-m', 'benchmark.run',
+        '--worker', case, '--root', root, '--jobs', str(jobs),
+    ], cwd=ROOT)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+# The cumulative import time of a module in milliseconds as reported by
+# -X importtime, the best of a few fresh interpreters.
+def measure_import_time(module, runs=5):
+    best = None
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+            cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            check=True
+        ).stderr.decode()
+        for line in output.splitlines():
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() == module:
+                milliseconds = int(fields[1]) / 1000
+                best = milliseconds if best is None \
+                    else min(best, milliseconds)
+    return best
+
+
+def load_baseline(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return dict()
+
+
+def compare_import_time(result, baseline, threshold):
+    if result is None or not baseline:
+        return ('', False)
+    change = result / baseline - 1
+    return ('%+.1f%%' % (change * 100), change > threshold)
+
+
+def compare(result, baseline, threshold):
+    if baseline is None or not baseline.get('books_per_second'):
+        return ('', False)
+    change = result['books_per_second'] / baseline['books_per_second'] - 1
+    return ('%+.1f%%' % (change * 100), change < -threshold)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark Fix Kindle Ebook Cover on synthetic libraries.'
+    )
+    parser.add_argument('--books', type=int, nargs='+', default=[100, 1000])
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=CASES)
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--workdir', default=None)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save', action='store_true',
+                        help='Store the results as the new baseline.')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Slowdown reported as a regression '
+                        '(default: 0.2)')
+    parser.add_argument('--worker', choices=CASES, help=argparse.SUPPRESS)
+    parser.add_argument('--root', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        print(json.dumps(run_case(args.worker, args.root, args.jobs)))
+        return
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='fixcover-benchmark-')
+    baseline = load_baseline(args.baseline)
+    results = dict()
+    regressions = 0
+
+    print('%-24s %9s %9s' % ('import', 'ms', 'baseline'))
+    for module in IMPORT_MODULES:
+        milliseconds = measure_import_time(module)
+        results.setdefault('imports', dict())[module] = milliseconds
+        change, regression = compare_import_time(
+            milliseconds, baseline.get('imports', dict()).get(module),
+            args.threshold
+        )
+        regressions += regression
+        print('%-24s %9.1f %9s%s' % (
+            module, milliseconds, change, ' !' if regression else ''
+        ))
+    print()
+
+    print('%-8s %7s %9s %10s %9s %9s' % (
+        'case', 'books', 'seconds', 'books/s', 'rss (MB)', 'baseline'))
+    for books in args.books:
+        root = prepare_library(workdir, books)
+        for case in args.cases:
+            restore_library(root)
+            result = spawn_case(case, root, args.jobs)
+            results.setdefault(case, dict())[str(books)] = result
+            change, regression = compare(
+                result, baseline.get(case, dict()).get(str(books)),
+                args.threshold
+            )
+            regressions += regression
+            print('%-8s %7d %9.3f %10.1f %9s %9s%s' % (
+                case, books, result['seconds'], result['books_per_second'],
+                '%.1f' % result['rss_mb'] if result['rss_mb'] else '-',
+                change, ' !' if regression else ''
+            ))
+
+    if args.workdir is None:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.save:
+        with open(args.baseline, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+        print('Baseline saved: %s' % args.baseline)
+
+    if regressions > 0:
+        print('%d regression(s) against the baseline.' % regressions)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
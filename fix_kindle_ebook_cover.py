@@ -4,7 +4,23 @@
 import sys
 import argparse
 
+from Events import TextSink, JSONLinesSink, SummarySink
 from FixCover import FixCover
+from Thumbnail import MODEL_SIZES, get_thumbnail_size
+
+
+def thumbnail_size(value):
+    try:
+        return get_thumbnail_size(value)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError('must be at least 1')
+    return number
 
 
 if __name__ == "__main__":
@@ -18,15 +34,128 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         '-a', '--action', dest='action',
-        default='fix', choices=['fix', 'clean'],
+        default='fix', choices=['fix', 'clean', 'convert'],
         help='Specify an action to process ebook cover (default: fix)',
     )
     parser.add_argument(
         '-d', '--db', dest='database',
         default=None, help='Specify a sqlite3 database file.',
     )
+    parser.add_argument(
+        '-m', '--manifest', dest='manifest', action='store_true',
+        help='Keep a manifest on the Kindle to skip unchanged ebooks.',
+    )
+    parser.add_argument(
+        '-r', '--resume', dest='resume', action='store_true',
+        help='Journal the run so that it can be resumed, and skip the\n'
+        'ebooks an interrupted run with this option already fixed.',
+    )
+    parser.add_argument(
+        '-w', '--watch', dest='watch', action='store_true',
+        help='Keep running and fix the covers of new ebooks and damaged\n'
+        'thumbnails as they appear (inotify on Linux, polling elsewhere).',
+    )
+    parser.add_argument(
+        '-j', '--jobs', dest='jobs', type=int,
+        default=1, help='Number of ebooks to process in parallel (default: 1)',
+    )
+    parser.add_argument(
+        '--devices', dest='devices', type=positive_int, default=1,
+        help='Number of Kindle roots to process at the same time (default: 1)',
+    )
+    parser.add_argument(
+        '--per-bus', dest='per_bus', type=positive_int, default=1,
+        help='Number of Kindle roots processed at the same time on one USB\n'
+        'controller (default: 1)',
+    )
+    parser.add_argument(
+        '--executor', dest='executor',
+        default='thread', choices=['thread', 'process'],
+        help='Run parallel jobs on threads or processes (default: thread)',
+    )
+    parser.add_argument(
+        '-t', '--thumbnail', dest='thumbnail', default=None,
+        type=thumbnail_size,
+        help='Write thumbnails sized for a Kindle model (%s)\n'
+        'or WIDTHxHEIGHT instead of full covers (uses Pillow if installed).'
+        % ', '.join(MODEL_SIZES),
+    )
+    parser.add_argument(
+        '--confidence', dest='confidence',
+        default='high', choices=['high', 'medium', 'low'],
+        help='Clean the orphan covers found with at least this confidence\n'
+        '(default: high)',
+    )
+    parser.add_argument(
+        '--quarantine', dest='quarantine', action='store_true',
+        help='Move orphan covers to a hidden directory in the Kindle root\n'
+        'instead of deleting them.',
+    )
+    parser.add_argument(
+        '--cache', dest='cache', default=None, metavar='DIR',
+        help='Keep extracted covers in DIR on the computer and reuse them\n'
+        'for the same ebooks on other Kindles.',
+    )
+    parser.add_argument(
+        '--cache-size', dest='cache_size', type=int, default=1024,
+        metavar='MB',
+        help='Size limit of the cover cache, the least recently used\n'
+        'covers are removed above it (default: 1024)',
+    )
+    parser.add_argument(
+        '--durability', dest='durability',
+        default='none', choices=['none', 'file', 'batch'],
+        help='Sync written thumbnails to disk: never, after every file,\n'
+        'or once at the end of the run (default: none)',
+    )
+    parser.add_argument(
+        '--plan', dest='plan', action='store_true',
+        help='Print the planned actions as JSON without touching the Kindle.',
+    )
+    parser.add_argument(
+        '--stats', dest='stats', nargs='?', const=True, default=None,
+        metavar='FILE',
+        help='Print timings and counters of the run as JSON, or write them\n'
+        'to FILE.',
+    )
+    parser.add_argument(
+        '--profile', dest='profile', action='store_true',
+        help='Add cProfile and tracemalloc results to the statistics.',
+    )
+    parser.add_argument(
+        '-o', '--output', dest='output',
+        default='text', choices=['text', 'jsonl', 'summary'],
+        help='Log as text, as JSON lines events, or only print a summary\n'
+        '(default: text)',
+    )
 
     args = parser.parse_args()
+    if args.watch and (args.action != 'fix' or args.plan):
+        parser.error('--watch only works with the fix action.')
+
+    sinks = {
+        'text': TextSink,
+        'jsonl': JSONLinesSink,
+        'summary': SummarySink,
+    }
+
+    # The plan is the output of --plan, keep the log out of its way.
+    if args.plan and args.output == 'text':
+        events = TextSink(
+            lambda text: print(text, file=sys.stderr), print
+        )
+    else:
+        events = sinks[args.output]()
 
-    fix_cover = FixCover(logger=print, db=args.database)
-    fix_cover.handle(action=args.action, roots=args.path)
+    with FixCover(
+        events=events, db=args.database, manifest=args.manifest,
+        jobs=args.jobs, executor=args.executor, thumbnail=args.thumbnail,
+        durability=args.durability, plan=args.plan, stats=args.stats,
+        profile=args.profile, resume=args.resume, devices=args.devices,
+        per_bus=args.per_bus, cache=args.cache, cache_size=args.cache_size,
+        confidence=args.confidence, quarantine=args.quarantine,
+    ) as fix_cover:
+        if args.watch:
+            fix_cover.watch(roots=args.path)
+        else:
+            fix_cover.handle(action=args.action, roots=args.path)
@@ -1,31 +1,43 @@
 # Tkinter API Reference: https://tkdocs.com/pyref/index.html
 
 import sys
+import time
+import queue
 import threading
 from tkinter import (
-    Tk, StringVar, ttk, filedialog, scrolledtext, DISABLED, NORMAL, END, E, W
+    Tk, StringVar, ttk, scrolledtext, DISABLED, NORMAL, END, E, W
 )
 
+from Events import TextSink
 from FixCover import FixCover
 
 
 class Application(ttk.Frame):
+    # The worker thread only puts events on a queue, the widgets are updated
+    # from the Tk thread in batches.
+    poll_interval = 100
+    batch_size = 500
+    max_log_lines = 5000
+
     def __init__(self):
         root = Tk()
         super().__init__(root, padding=10)
 
         self.entryvalue = StringVar(self)
+        self.statusvalue = StringVar(self)
+        self.events = queue.Queue()
+        self.formatter = TextSink()
+        self.started = None
 
         self.grid()
         self.create_widgets()
         self.layout_widgets()
         self.bind_action()
 
-        self.fixcover = FixCover(
-            logger=self.get_logger,
-            progress=self.get_progress,
-        )
+        self.fixcover = FixCover(events=self.events.put)
+        self.after(self.poll_interval, self.drain_events)
 
+    def detect_kindle_root(self):
         roots = self.fixcover.get_kindle_root_automatically()
         if len(roots) > 0:
             root = roots[0]
@@ -38,6 +50,7 @@ class Application(ttk.Frame):
         self.entry.unbind('<Double-1>')
         self.entry.bind('<Double-1>', lambda e: self.prevent_dbclick_twice())
 
+        from tkinter import filedialog
         value = filedialog.askdirectory()
         if value != '':
             self.entryvalue.set(value)
@@ -49,33 +62,69 @@ class Application(ttk.Frame):
     def reset_kindle_root(self):
         self.entryvalue.set(self.entry.get())
 
-    def get_logger(self, text):
-        self.insert_log(text)
-        self.log.see(END)
-
     def insert_log(self, text):
         self.log.insert(END, '%s\n' % text)
+        lines = int(self.log.index('end-1c').split('.')[0])
+        if lines > self.max_log_lines:
+            self.log.delete(1.0, '%d.0' % (lines - self.max_log_lines))
+        self.log.see(END)
 
-    def get_progress(self, factor):
-        if factor == 0:
+    def drain_events(self):
+        lines = []
+        progress = None
+        for _ in range(self.batch_size):
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if event.type == 'progress':
+                progress = event
+            elif event.type == 'run_finished':
+                self.set_running(False)
+            text = self.formatter.format(event)
+            if text is not None:
+                lines.append(text)
+        if len(lines) > 0:
+            self.insert_log('\n'.join(lines))
+        if progress is not None:
+            self.show_progress(progress)
+        self.after(self.poll_interval, self.drain_events)
+
+    def show_progress(self, event):
+        if event.total is None:
             self.progress['value'] = 100
             return
-        self.progress.step(float(str(100 / factor)[:3]))
+        self.progress['value'] = event.done / event.total * 100
+        elapsed = time.time() - self.started
+        if elapsed <= 0 or event.done < 1:
+            return
+        remaining = elapsed / event.done * (event.total - event.done)
+        self.statusvalue.set('%d/%d  %.1f items/s  %.1f MB/s  ETA %d:%02d' % (
+            event.done, event.total, event.done / elapsed,
+            event.bytes / elapsed / 1024 / 1024,
+            remaining // 60, remaining % 60
+        ))
+
+    def set_running(self, running):
+        state, cancel_state = (DISABLED, NORMAL) if running \
+            else (NORMAL, DISABLED)
+        self.choose['state'] = state
+        self.recover['state'] = state
+        self.cancel['state'] = cancel_state
+
+    def cancel_job(self):
+        self.cancel['state'] = DISABLED
+        self.fixcover.cancel()
 
-    def handle_ebook_cover(self, action='fix'):
+    def fire_thread(self):
         self.log.delete(1.0, END)
         self.progress['value'] = 0
-        self.choose['state'] = DISABLED
-        self.fixcover.handle(
-            action=action,
-            roots=self.entryvalue.get(),
-        )
-        self.choose['state'] = NORMAL
-
-    def fire_thread(self):
+        self.statusvalue.set('')
+        self.started = time.time()
+        self.set_running(True)
         threading.Thread(
-            target=self.handle_ebook_cover,
-            kwargs={'action': 'fix'},
+            target=self.fixcover.handle,
+            kwargs={'action': 'fix', 'roots': self.entryvalue.get()},
             daemon=True,
         ).start()
 
@@ -90,9 +139,14 @@ class Application(ttk.Frame):
         self.recover = ttk.Button(
             self.control, text='Recover', command=self.fire_thread
         )
+        self.cancel = ttk.Button(
+            self.control, text='Cancel', command=self.cancel_job,
+            state=DISABLED
+        )
         self.progress = ttk.Progressbar(
             self, length=580, mode='determinate', maximum=100
         )
+        self.status = ttk.Label(self, textvariable=self.statusvalue)
         self.log = scrolledtext.ScrolledText(self)
 
     def layout_widgets(self):
@@ -100,12 +154,15 @@ class Application(ttk.Frame):
         self.entry.grid(column=0, row=0, sticky=W+E)
         self.choose.grid(column=1, row=0, sticky=E)
         self.recover.grid(column=2, row=0, sticky=E)
-        self.progress.grid(column=0, row=1, pady=10)
-        self.log.grid(column=0, row=2)
+        self.cancel.grid(column=3, row=0, sticky=E)
+        self.progress.grid(column=0, row=1, pady=(10, 0))
+        self.status.grid(column=0, row=2, sticky=W, pady=(0, 10))
+        self.log.grid(column=0, row=3)
 
         self.control.columnconfigure(0, weight=30)
         self.control.columnconfigure(1, weight=1)
         self.control.columnconfigure(2, weight=1)
+        self.control.columnconfigure(3, weight=1)
 
     def bind_action(self):
         self.entry.bind('<FocusOut>', lambda e: self.reset_kindle_root())
@@ -126,6 +183,8 @@ def main():
     y = round(app.master.winfo_screenheight() / 2 - height / 2)
     app.master.geometry('%sx%s+%s+%s' % (width, height, x, y))
     app.master.deiconify()
+    # Probing the drives waits for the window to be shown.
+    app.after_idle(app.detect_kindle_root)
 
     app.mainloop()
 
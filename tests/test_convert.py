@@ -0,0 +1,42 @@
+from benchmark.generator import build_library, build_mobi
+from FixCover import FixCover
+from Library import scan_library
+
+
+def test_convert_skips_books_it_can_not_rewrite(tmp_path):
+    root = str(tmp_path / 'kindle')
+    build_library(
+        root, books=10, pdoc=1.0, kinds=('kf8', 'kfx'), text_sections=1,
+        images=1
+    )
+    with open(str(tmp_path / 'kindle' / 'documents' / 'Replica.azw4'),
+              'wb') as file:
+        file.write(b'\0' * 100)
+    with open(str(tmp_path / 'kindle' / 'documents' / 'Sample.azw3'),
+              'wb') as file:
+        file.write(build_mobi('B0SAMPLE01', 'EBSP', 'kf8', 1, 1))
+    events = []
+
+    with FixCover(events=events.append, plan=True) as fix_cover:
+        fix_cover.convert_ebooks(root + '/documents')
+        counters = fix_cover.stats.counters
+        assert counters.get('books_failed', 0) == 0
+        assert counters.get('books_converted') == 5
+        assert counters.get('books_skipped') == 7
+    converted = [e.ebook for e in events if e.type == 'book_converted']
+    assert len(converted) == 5
+    assert all(path.endswith('.azw3') for path in converted)
+
+    with FixCover() as fix_cover:
+        fix_cover.convert_ebooks(root + '/documents')
+    cdetypes = {
+        book.path.endswith('.kfx'): book.cdetype
+        for book in scan_library(root).books()
+        if (book.asin or '').startswith('B00')
+    }
+    assert cdetypes == {False: 'EBOK', True: 'PDOC'}
+    samples = [
+        book.cdetype for book in scan_library(root).books()
+        if book.asin == 'B0SAMPLE01'
+    ]
+    assert samples == ['EBSP']
@@ -0,0 +1,55 @@
+import os
+import threading
+
+from CoverCache import CoverCache
+
+
+def test_concurrent_writes_are_never_read_partially(tmp_path):
+    cache = CoverCache(str(tmp_path / 'cache'))
+    fingerprint = '1000-%s' % ('ab' * 20)
+    covers = [bytes([number]) * (512 * 1024) for number in range(8)]
+    torn = []
+    done = threading.Event()
+
+    def write(cover):
+        for _ in range(20):
+            cache.set_cover(fingerprint, (330, 470), cover)
+
+    def read():
+        while not done.is_set():
+            cover = cache.get_cover(fingerprint, (330, 470))
+            if cover is not None and cover not in covers:
+                torn.append(len(cover))
+
+    readers = [threading.Thread(target=read) for _ in range(2)]
+    writers = [threading.Thread(target=write, args=(c,)) for c in covers]
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    done.set()
+    for thread in readers:
+        thread.join()
+
+    assert torn == []
+    assert cache.get_cover(fingerprint, (330, 470)) in covers
+    names = os.listdir(os.path.dirname(
+        cache.get_entry_path(fingerprint, 'json')
+    ))
+    assert [name for name in names if name.endswith('.tmp')] == []
+
+
+def test_metadata_round_trip_and_eviction(tmp_path):
+    cache = CoverCache(str(tmp_path / 'cache'), limit=3000)
+    for number in range(4):
+        fingerprint = '%x-%040x' % (number, number)
+        cache.set_metadata(fingerprint, 'B%09d' % number, 'EBOK', (10, 20))
+        cache.set_cover(fingerprint, None, b'x' * 1000)
+
+    assert cache.evict() > 0
+    fingerprint = '3-%040x' % 3
+    assert cache.get_metadata(fingerprint) == {
+        'asin': 'B000000003', 'cdetype': 'EBOK', 'cover': [10, 20],
+        'thumb': None,
+    }
+    assert cache.get_cover('0-%040x' % 0) is None
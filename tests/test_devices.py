@@ -0,0 +1,16 @@
+from benchmark.generator import build_library
+from FixCover import FixCover
+from Library import scan_library
+
+
+def test_roots_are_processed_with_per_bus_below_one(tmp_path):
+    roots = [str(tmp_path / name) for name in ('kindle1', 'kindle2')]
+    for root in roots:
+        build_library(root, books=5, text_sections=1, images=1)
+
+    with FixCover(devices=2, per_bus=0) as fix_cover:
+        fix_cover.handle(action='fix', roots=roots)
+
+    for root in roots:
+        statuses = [book.status for book in scan_library(root).books()]
+        assert statuses == ['ok'] * 5
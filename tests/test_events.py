@@ -0,0 +1,11 @@
+from Events import Event, TextSink
+
+
+def test_text_sink_keeps_documents_apart_from_the_log():
+    log, documents = [], []
+    sink = TextSink(log.append, documents.append)
+    sink(Event('message', text='Fixing', sep=False))
+    sink(Event('plan', plan={'actions': []}))
+    sink(Event('progress', done=1, total=2, bytes=0))
+    assert log == ['Fixing']
+    assert documents == ['{\n  "actions": []\n}']
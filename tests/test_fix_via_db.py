@@ -0,0 +1,35 @@
+import os
+import sqlite3
+
+from benchmark.generator import build_library
+from FixCover import FixCover
+
+
+def count_rows(db, where):
+    connection = sqlite3.connect(db)
+    try:
+        return connection.execute(
+            'SELECT COUNT(*) FROM Entries WHERE %s' % where
+        ).fetchone()[0]
+    finally:
+        connection.close()
+
+
+def test_fix_via_db_generates_past_the_first_batch(tmp_path):
+    root = str(tmp_path / 'kindle')
+    build_library(root, books=250, db=True, text_sections=1, images=1)
+    db = os.path.join(root, 'cc.db')
+    connection = sqlite3.connect(db)
+    connection.execute('UPDATE Entries SET p_thumbnail = NULL')
+    connection.commit()
+    connection.close()
+
+    with FixCover(db=db) as fix_cover:
+        assert fix_cover.db_batch_size < 250
+        fix_cover.handle(action='fix', roots=[root])
+        generated = fix_cover.stats.counters.get('books_generated', 0)
+
+    assert generated == 250
+    assert count_rows(db, 'p_thumbnail IS NULL') == 0
+    for row in sqlite3.connect(db).execute('SELECT p_thumbnail FROM Entries'):
+        assert os.path.exists(row[0])
@@ -0,0 +1,31 @@
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded only by the code paths that need them.
+DEFERRED_MODULES = (
+    'sqlite3', 'concurrent.futures', 'DualMetaFix', 'hashlib', 'shutil',
+    'uuid', 'mmap',
+)
+
+
+def get_imported_modules(statement):
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True
+    )
+    return set(
+        line.rsplit('|', 1)[1].strip()
+        for line in process.stderr.splitlines()
+        if line.startswith('import time:') and '|' in line
+    )
+
+
+def test_fix_cover_import_defers_heavy_modules():
+    imported = get_imported_modules('import FixCover')
+    assert 'KindleUnpack' in imported
+    assert sorted(imported.intersection(DEFERRED_MODULES)) == []
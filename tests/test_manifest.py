@@ -0,0 +1,29 @@
+import Library
+from benchmark.generator import build_library
+from FixCover import FixCover
+
+
+def build_root(tmp_path, books=30):
+    root = str(tmp_path / 'kindle')
+    build_library(root, books=books, text_sections=1, images=1)
+    return root
+
+
+def test_manifest_skips_unchanged_books(tmp_path, monkeypatch):
+    root = build_root(tmp_path)
+    with FixCover(manifest=True) as fix_cover:
+        fix_cover.handle(action='fix', roots=[root])
+
+    parsed = []
+
+    def open_ebook(path):
+        parsed.append(path)
+        raise OSError(path)
+
+    monkeypatch.setattr(Library, 'open_ebook', open_ebook)
+    with FixCover(manifest=True) as fix_cover:
+        fix_cover.handle(action='fix', roots=[root])
+        counters = fix_cover.stats.counters
+        assert counters.get('books_fixed', 0) == 0
+        assert counters.get('books_generated', 0) == 0
+    assert parsed == []
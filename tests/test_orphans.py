@@ -0,0 +1,126 @@
+import os
+
+from benchmark.generator import build_library
+from FixCover import FixCover
+from Library import (
+    find_orphan_thumbnails, read_ebook_header, scan_thumbnails
+)
+
+
+NAMES = [
+    'thumbnail_B000000001_EBOK_portrait.jpg',
+    'thumbnail_B000000002_PDOC_portrait.jpg',
+    'thumbnail_B000000003_EBOK_portrait.jpg',
+    'thumbnail_B000000004_EBOK_portrait.jpg',
+    'thumbnail_B000000005_PDOC_portrait.jpg',
+]
+
+
+def scan(tmp_path, names=NAMES):
+    for name in names:
+        (tmp_path / name).write_bytes(b'\xff\xd8\xff\xd9')
+    return scan_thumbnails(str(tmp_path))
+
+
+def confidences(orphans):
+    return dict(
+        (thumbnail.asin, confidence) for thumbnail, confidence in orphans
+    )
+
+
+def test_orphan_confidence_levels(tmp_path):
+    books = {('B000000001', 'EBOK'), ('B000000002', 'EBOK')}
+    names = {'B000000003'}
+    orphans = find_orphan_thumbnails(scan(tmp_path), books, names)
+    assert confidences(orphans) == {
+        'B000000002': 'medium',
+        'B000000003': 'low',
+        'B000000004': 'high',
+        'B000000005': 'high',
+    }
+
+
+def test_books_without_asin_make_their_cdetype_low(tmp_path):
+    books = {('B000000001', 'EBOK'), (None, 'PDOC')}
+    orphans = find_orphan_thumbnails(scan(tmp_path), books, set())
+    assert confidences(orphans) == {
+        'B000000002': 'low',
+        'B000000003': 'high',
+        'B000000004': 'high',
+        'B000000005': 'low',
+    }
+
+
+def test_unreadable_books_only_claim_their_guessed_asin(tmp_path):
+    books = {('B000000001', 'EBOK')}
+    names = {'B000000004'}
+    orphans = find_orphan_thumbnails(scan(tmp_path), books, names)
+    assert confidences(orphans) == {
+        'B000000002': 'high',
+        'B000000003': 'high',
+        'B000000004': 'low',
+        'B000000005': 'high',
+    }
+
+
+def test_clean_is_not_held_back_by_an_unreadable_ebook(tmp_path):
+    root = str(tmp_path / 'kindle')
+    build_library(root, books=3, text_sections=1, images=1)
+    documents = os.path.join(root, 'documents')
+    thumbnails = os.path.join(root, 'system', 'thumbnails')
+    with open(os.path.join(documents, 'Manual_B0PRINT001.azw4'), 'wb') as file:
+        file.write(b'\0' * 100)
+    for asin in ('B0PRINT001', 'B100000000'):
+        name = 'thumbnail_%s_EBOK_portrait.jpg' % asin
+        with open(os.path.join(thumbnails, name), 'wb') as file:
+            file.write(b'\xff\xd8\xff\xd9')
+    events = []
+
+    with FixCover(events=events.append) as fix_cover:
+        fix_cover.handle(action='clean', roots=[root])
+
+    deleted = [
+        os.path.basename(e.thumbnail) for e in events
+        if e.type == 'orphan_deleted'
+    ]
+    assert deleted == ['thumbnail_B100000000_EBOK_portrait.jpg']
+
+
+def test_print_replica_ebooks_are_read(tmp_path):
+    root = str(tmp_path / 'kindle')
+    build_library(root, books=1, pdoc=0, kinds=('kf8',), text_sections=1,
+                  images=1)
+    books = [
+        os.path.join(path, name)
+        for path, _, names in os.walk(os.path.join(root, 'documents'))
+        for name in names if name.endswith('.azw3')
+    ]
+    path = books[0][:-len('.azw3')] + '.azw4'
+    os.rename(books[0], path)
+    assert read_ebook_header(path)[:2] == ('B000000000', 'EBOK')
+
+
+def test_clean_removes_orphans_in_one_phase(tmp_path):
+    root = str(tmp_path / 'kindle')
+    build_library(root, books=5, text_sections=1, images=1)
+    thumbnails = os.path.join(root, 'system', 'thumbnails')
+    for number in range(3):
+        name = 'thumbnail_B10000000%d_EBOK_portrait.jpg' % number
+        with open(os.path.join(thumbnails, name), 'wb') as file:
+            file.write(b'\xff\xd8\xff\xd9')
+    events = []
+
+    with FixCover(events=events.append) as fix_cover:
+        fix_cover.handle(action='clean', roots=[root])
+
+    deleted = [e for e in events if e.type == 'orphan_deleted']
+    assert len(deleted) == 3
+    assert all(e.confidence == 'high' for e in deleted)
+    phases = [
+        e for e in events
+        if e.type == 'phase_started' and e.phase == 'cleanup'
+    ]
+    assert len(phases) == 1
+    assert not any(
+        name.startswith('thumbnail_B1') for name in os.listdir(thumbnails)
+    )
@@ -0,0 +1,25 @@
+from benchmark.generator import build_library
+from FixCover import FixCover
+
+
+def test_progress_restarts_after_a_cancelled_run(tmp_path):
+    root = str(tmp_path / 'kindle')
+    build_library(root, books=10, text_sections=1, images=1)
+    cancel_after_planning = [True]
+    progress = []
+
+    def on_event(event):
+        if event.type == 'phase_finished' and event.phase == 'planning' \
+                and cancel_after_planning[0]:
+            fix_cover.cancel()
+        elif event.type == 'progress' and event.done is not None:
+            progress.append((event.done, event.total))
+
+    with FixCover(events=on_event) as fix_cover:
+        fix_cover.handle(action='fix', roots=[root])
+        cancel_after_planning[0] = False
+        del progress[:]
+        fix_cover.handle(action='fix', roots=[root])
+
+    assert progress[0][0] == 1
+    assert all(done <= total for done, total in progress)
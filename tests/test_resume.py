@@ -0,0 +1,86 @@
+import os
+
+from benchmark.generator import build_library
+from FixCover import FixCover
+from Journal import Journal
+from Library import scan_library
+
+
+def build_root(tmp_path, books=30):
+    root = str(tmp_path / 'kindle')
+    build_library(root, books=books, text_sections=1, images=1)
+    return root
+
+
+def test_journal_replays_unfinished_books(tmp_path):
+    root = str(tmp_path)
+    done = os.path.join(root, 'done.azw3')
+    pending = os.path.join(root, 'pending.azw3')
+    for path in (done, pending):
+        with open(path, 'wb') as file:
+            file.write(b'book')
+    temp_path = os.path.join(root, '.thumbnail_pending.jpg.tmp')
+
+    journal = Journal(root, 'fix', resume=True)
+    journal.begin(done, [os.path.join(root, 'thumbnail_done.jpg')])
+    journal.finish(done)
+    journal.begin(pending, [os.path.join(root, 'thumbnail_pending.jpg')])
+    with open(temp_path, 'wb') as file:
+        file.write(b'partial')
+    # Interrupted: the journal is never closed.
+    journal.file.close()
+
+    journal = Journal(root, 'fix', resume=True)
+    assert journal.is_done(done)
+    assert not journal.is_done(pending)
+    assert not os.path.exists(temp_path)
+    journal.close(completed=True)
+    assert not os.path.exists(journal.path)
+
+
+def test_journal_restarts_for_another_action(tmp_path):
+    root = str(tmp_path)
+    path = os.path.join(root, 'book.azw3')
+    with open(path, 'wb') as file:
+        file.write(b'book')
+    journal = Journal(root, 'fix', resume=True)
+    journal.finish(path)
+    journal.close()
+
+    assert not Journal(root, 'convert', resume=True).is_done(path)
+
+
+def test_fix_resumes_a_cancelled_run(tmp_path):
+    root = build_root(tmp_path)
+    fixed = []
+
+    def cancel_after_five(event):
+        if event.type in ('book_fixed', 'book_generated'):
+            fixed.append(event.ebook)
+            if len(set(fixed)) == 5:
+                fix_cover.cancel()
+
+    with FixCover(events=cancel_after_five, resume=True) as fix_cover:
+        fix_cover.handle(action='fix', roots=[root])
+    assert os.path.exists(os.path.join(root, Journal.filename))
+
+    with FixCover(resume=True) as fix_cover:
+        fix_cover.handle(action='fix', roots=[root])
+        assert fix_cover.stats.counters.get('books_resumed') == 5
+    assert not os.path.exists(os.path.join(root, Journal.filename))
+    statuses = [book.status for book in scan_library(root).books()]
+    assert statuses == ['ok'] * len(statuses)
+
+
+def test_fix_without_resume_writes_no_journal(tmp_path):
+    root = build_root(tmp_path)
+    journals = []
+
+    def watch_journal(event):
+        if os.path.exists(os.path.join(root, Journal.filename)):
+            journals.append(event.type)
+
+    with FixCover(events=watch_journal) as fix_cover:
+        fix_cover.handle(action='fix', roots=[root])
+    assert journals == []
+
@@ -0,0 +1,77 @@
+import os
+import struct
+from io import BytesIO
+
+import pytest
+
+from benchmark.generator import build_jpeg, build_library
+from FixCover import FixCover
+from Library import is_damaged_thumbnail
+from Thumbnail import PLACEHOLDER_SIZE, get_jpeg_frame, make_thumbnail
+
+
+def with_app_segments(jpeg, count):
+    segment = b'\xff\xe1' + struct.pack('>H', 65535) + b'\0' * 65533
+    return jpeg[:2] + segment * count + jpeg[2:]
+
+
+def write(tmp_path, data):
+    path = tmp_path / 'thumbnail_B000000000_EBOK_portrait.jpg'
+    path.write_bytes(data)
+    return str(path)
+
+
+JPEG = build_jpeg(330, 470, 95000)
+
+
+@pytest.mark.parametrize('data, damaged', [
+    (JPEG, False),
+    (build_jpeg(60, 90, 900), True),
+    (build_jpeg(80, 120, PLACEHOLDER_SIZE), False),
+    (JPEG + b'\0' * 100, False),
+    (with_app_segments(JPEG, 2), False),
+    (JPEG[:len(JPEG) // 2], True),
+    (JPEG[:len(JPEG) // 2] + b'\0' * (len(JPEG) - len(JPEG) // 2), True),
+    (b'\0' * len(JPEG), True),
+    (with_app_segments(JPEG, 2)[:-2], True),
+    (build_jpeg(20000, 470, 5000), True),
+    (b'\xff\xd8\xff', True),
+    (b'', True),
+])
+def test_is_damaged_thumbnail(tmp_path, data, damaged):
+    path = write(tmp_path, data)
+    assert is_damaged_thumbnail(path) is damaged
+    assert is_damaged_thumbnail(path, len(data)) is damaged
+
+
+def test_missing_thumbnail_is_not_damaged(tmp_path):
+    assert is_damaged_thumbnail(str(tmp_path / 'missing.jpg')) is False
+
+
+def test_get_jpeg_frame():
+    assert get_jpeg_frame(JPEG) == (0xC0, 330, 470)
+    assert get_jpeg_frame(JPEG[:10]) is None
+
+
+def test_placeholder_thumbnails_are_fixed(tmp_path):
+    root = str(tmp_path / 'kindle')
+    build_library(root, books=3, damaged=0, missing=0, text_sections=1,
+                  images=1)
+    thumbnails = os.path.join(root, 'system', 'thumbnails')
+    path = os.path.join(thumbnails, sorted(os.listdir(thumbnails))[0])
+    with open(path, 'wb') as file:
+        file.write(build_jpeg(60, 90, 900))
+
+    with FixCover() as fix_cover:
+        fix_cover.handle(action='fix', roots=[root])
+    assert not is_damaged_thumbnail(path)
+
+
+def test_make_thumbnail_never_writes_a_placeholder():
+    Image = pytest.importorskip('PIL.Image')
+    output = BytesIO()
+    Image.new('RGB', (1000, 1500), (128, 128, 128)).save(output, 'JPEG')
+    cover = output.getvalue()
+    assert len(cover) >= PLACEHOLDER_SIZE
+
+    assert make_thumbnail(cover, None, (220, 330)) == cover